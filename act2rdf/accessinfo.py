@@ -2,7 +2,6 @@ from dataclasses import dataclass, field
 from enum import Enum, auto
 from typing import Optional, List, Union
 
-import union as union
 from rdflib import Namespace
 
 
@@ -29,4 +28,4 @@ class NamespaceInfo:
 
     def __post_init__(self):
         if not isinstance(self.officialuri, Namespace):
-            self.officialuri = NamespaceInfo(str(self.officialuri))
+            self.officialuri = Namespace(str(self.officialuri))
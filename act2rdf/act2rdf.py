@@ -1,12 +1,26 @@
+import argparse
 import itertools
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from csv import DictReader
 from io import TextIOWrapper
-from typing import Iterator, Tuple
+from tempfile import TemporaryDirectory
+from typing import Iterator, Tuple, List, Union, Optional, Callable, Dict, Any
 from zipfile import ZipFile
 
 from rdflib import Namespace, Graph, Literal, RDF, OWL
 from rdflib.namespace import SKOS, DCTERMS
+from rdflib.plugins.parsers.ntriples import NTriplesParser
+
+from coderesolver import CodeResolver
+from compactstore import CompactSink
+from fingerprint import FingerprintStore, FINGERPRINT_FILE, combine, zip_member_fingerprint
+from hierarchy import PathIndex
+from metrics import metrics, report_file
+from shards import ShardedSink, manifest_file, shard_base
+from termcache import TermCache
+from triplesink import TripleSink, NTriplesSink, open_sink
 
 # TODO: Determine the canonical URI for the ACT
 namespaces = {
@@ -51,6 +65,10 @@ other_urls = {
     'RXNORM': 'https://rxnav.nlm.nih.gov/REST/rxcui/{cid}/properties'
 }
 
+# Interned ACT concept URIs -- ancestor nodes recur in every descendant row
+act_terms = TermCache(namespaces['ACT'])
+code_resolver = CodeResolver(namespaces)
+
 
 def pairwise(iterable) -> Iterator[Tuple]:
     a, b = itertools.tee(iterable)
@@ -58,52 +76,304 @@ def pairwise(iterable) -> Iterator[Tuple]:
     return zip(a, b)
 
 
-def read_rdf(reader: DictReader, g: Graph) -> Graph:
+def read_rdf(reader: DictReader, g: Union[Graph, TripleSink], index: Optional[PathIndex] = None) \
+        -> Union[Graph, TripleSink]:
     """
     Read ACT ontology from reader and convert to triples to store in a graph
-    :type g: rdflib.Graph
+    :type g: rdflib.Graph or triplesink.TripleSink
     :type reader: csv.DictReader
     :param reader: csv.DictReader
-    :param g: rdflib.Graph
-    :return: A Graph
+    :param g: rdflib.Graph or a streaming sink that writes the triples as they are added
+    :param index: hierarchy edges already emitted into g.  Pass the same index when reading several files into g
+    :return: A Graph (or the sink)
     """
-    ACT = namespaces['ACT']
+    if index is None:
+        index = PathIndex()
+    ACT = act_terms.uri
     g.bind('SKOS', SKOS)
-    g.add((ACT.ACT, RDF.type, SKOS.ConceptScheme))
-    g.add((ACT.ACT, DCTERMS.title, Literal("ACT Ontology")))
-    g.add((ACT.ACT, OWL.versionInfo, Literal('2.0.1')))
+    act_root = ACT('ACT')
+    g.add((act_root, RDF.type, SKOS.ConceptScheme))
+    g.add((act_root, DCTERMS.title, Literal("ACT Ontology")))
+    g.add((act_root, OWL.versionInfo, Literal('2.0.1')))
+    nrows = 0
     for row in reader:
+        nrows += 1
         nodes = [n for n in row['C_FULLNAME'].split('\\') if n]
-        for n1, n2 in pairwise(nodes):
-            g.add((ACT[n2], SKOS.broader, ACT[n1]))
-        g.add((ACT[nodes[-1]], RDF.type, SKOS.Concept))
-        if row['C_BASECODE'].strip():
-            if ':' in row['C_BASECODE']:
-                tokens = row['C_BASECODE'].split(':')
-                if len(tokens) == 2:
-                    if tokens[0] in namespaces:
-                        g.add((ACT[nodes[-1]], SKOS.exactMatch, namespaces[tokens[0]][tokens[1].replace(' ', '_')]))
-                    else:
-                        print('[NS NOT FOUND] ' + str(row))
-                else:
-                    print('[NO NS] ' + str(row))
-        g.add((ACT[nodes[-1]], SKOS.prefLabel, Literal(row['C_NAME'])))
+        for child, parent in index.add_path(nodes):
+            g.add((ACT(child), SKOS.broader, ACT(parent)))
+        cid = ACT(nodes[-1])
+        g.add((cid, RDF.type, SKOS.Concept))
+        code = code_resolver.resolve(row['C_BASECODE'])
+        if code is not None:
+            g.add((cid, SKOS.exactMatch, code))
+        g.add((cid, SKOS.prefLabel, Literal(row['C_NAME'])))
+    metrics.count('read', 'rows', nrows)
     return g
 
 
-if __name__ == '__main__':
-    print(os.getcwd())
-    # process all files in the data directory
-    g = Graph()
-    for file in os.scandir('data'):
+def act_files(data_dir: str) -> Iterator[str]:
+    """
+    Return the ACT ontology archives in data_dir
+    :param data_dir: directory to scan
+    :return: full path of each archive
+    """
+    for file in sorted(os.scandir(data_dir), key=lambda f: f.name):
         if not file.name.endswith('.zip') or file.name.startswith('ACT_CONCEPT_'):
             continue
-        full_path = os.path.join('data', file.name)
-        zf = ZipFile(full_path)
-        files = zf.infolist()
-        print(files)
+        yield os.path.join(data_dir, file.name)
+
+
+def act_members(data_dir: str) -> Iterator[Tuple[str, str]]:
+    """
+    Return every data member of every ACT archive in data_dir
+    :param data_dir: directory to scan
+    :return: archive path and member name
+    """
+    for full_path in act_files(data_dir):
         with ZipFile(full_path) as zf:
-            with zf.open(files[0]) as infile:
+            for member in zf.infolist():
+                if not member.is_dir():
+                    yield full_path, member.filename
+
+
+def read_member(zip_path: str, member: str, g: Union[Graph, TripleSink], index: Optional[PathIndex] = None) \
+        -> Union[Graph, TripleSink]:
+    """
+    Convert a single member of an ACT archive into g
+    :param zip_path: archive path
+    :param member: member name within the archive
+    :param g: target graph or sink
+    :param index: hierarchy index shared across members
+    :return: g
+    """
+    with metrics.unit('file', f"{os.path.basename(zip_path)}/{member}"), metrics.stage('read'):
+        with ZipFile(zip_path) as zf:
+            with zf.open(member) as infile:
                 reader = DictReader(TextIOWrapper(infile, 'utf-8'), delimiter='|')
-                g = read_rdf(reader, g)
-    g.serialize('act-ontology.ttl', format='ttl')
\ No newline at end of file
+                return read_rdf(reader, g, index)
+
+
+def convert(data_dir: str, g: Union[Graph, TripleSink]) -> Union[Graph, TripleSink]:
+    """
+    Convert all of the ACT archives in data_dir into g
+    :param data_dir: directory containing the ACT zip files
+    :param g: target graph or sink
+    :return: g
+    """
+    index = PathIndex()
+    for zip_path, member in act_members(data_dir):
+        g = read_member(zip_path, member, g, index)
+    return g
+
+
+def member_size(zip_path: str, member: str) -> int:
+    """ Return the uncompressed size of an archive member """
+    with ZipFile(zip_path) as zf:
+        return zf.getinfo(member).file_size
+
+
+def partial_name(zip_path: str, member: str) -> str:
+    """ Return the name of the partial output file for an archive member """
+    return f"{os.path.splitext(os.path.basename(zip_path))[0]}__{os.path.basename(member)}.nt"
+
+
+def convert_member(zip_path: str, member: str, partial_path: str) \
+        -> Tuple[str, int, Dict[str, Any], Dict[str, Any]]:
+    """
+    Worker: convert a single archive member into an N-Triples partial output
+    :param zip_path: archive path
+    :param member: member name within the archive
+    :param partial_path: file to write
+    :return: partial_path, number of triples written, the worker's run metrics and code resolution tallies
+    """
+    metrics.reset()
+    code_resolver.reset()
+    with open(partial_path, 'w', encoding='utf-8') as outf:
+        with NTriplesSink(outf) as sink:
+            read_member(zip_path, member, sink)
+    metrics.count('read', 'triples', len(sink))
+    return partial_path, len(sink), metrics.report(), code_resolver.tallies()
+
+
+class _SinkAdapter:
+    """ NTriplesParser sink that forwards parsed triples to a Graph or TripleSink """
+    def __init__(self, g: Union[Graph, TripleSink]) -> None:
+        self.g = g
+
+    def triple(self, s, p, o) -> None:
+        self.g.add((s, p, o))
+
+
+def merge_partials(partials: List[str], g: Union[Graph, TripleSink]) -> Union[Graph, TripleSink]:
+    """
+    Merge the partial outputs into g.  Triples that occur in more than one partial (the ACT scheme header and
+    the upper levels of the skos:broader hierarchy) are removed by g itself.
+    :param partials: N-Triples partial files
+    :param g: target graph or sink
+    :return: g
+    """
+    parser = NTriplesParser(_SinkAdapter(g))
+    with metrics.stage('merge'):
+        for partial in partials:
+            with open(partial, 'rb') as inf:
+                parser.parse(inf)
+        metrics.count('merge', 'files', len(partials))
+    return g
+
+
+def convert_partials(data_dir: str, work_dir: str, jobs: int, fingerprints: Optional[FingerprintStore] = None) \
+        -> List[str]:
+    """
+    Convert every ACT archive member in data_dir into an N-Triples partial file in work_dir
+    :param data_dir: directory containing the ACT zip files
+    :param work_dir: directory for the partial outputs
+    :param jobs: number of worker processes
+    :param fingerprints: if present, members whose fingerprint and partial are unchanged are skipped
+    :return: list of partial files for all of the members
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    partials = []
+    todo = []
+    for zip_path, member in act_members(data_dir):
+        partial = os.path.join(work_dir, partial_name(zip_path, member))
+        partials.append(partial)
+        fp = None
+        if fingerprints is not None:
+            fp = zip_member_fingerprint(zip_path, member)
+            if fingerprints.unchanged(partial, fp, [partial]):
+                print(f"{os.path.basename(partial)}: unchanged")
+                continue
+        todo.append((zip_path, member, partial, fp))
+    # Submit the largest members first so the slowest file is not started last
+    todo.sort(key=lambda m: member_size(m[0], m[1]), reverse=True)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(convert_member, zip_path, member, partial): fp
+                   for zip_path, member, partial, fp in todo}
+        for future in as_completed(futures):
+            partial, ntriples, report, tallies = future.result()
+            metrics.merge(report)
+            code_resolver.merge(tallies)
+            print(f"{os.path.basename(partial)}: {ntriples} triples")
+            if fingerprints is not None:
+                fingerprints.record(partial, futures[future], [partial])
+                fingerprints.save()
+    return sorted(partials)
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Convert the ACT ontology archives to RDF", prog="act2rdf")
+    parser.add_argument("-d", "--datadir", help="Directory containing ACT zip files", default='data')
+    parser.add_argument("-o", "--output", help="Output file", default='act-ontology.ttl')
+    parser.add_argument("-f", "--format", help="Output format.  'graph' builds an in-memory rdflib Graph and "
+                                               "serializes it as turtle, 'nt' and 'ttl' stream the triples as "
+                                               "they are generated and 'compact' writes a binary compact store",
+                        choices=['graph', 'nt', 'ttl', 'compact'], default='graph')
+    parser.add_argument("-j", "--jobs", help="Number of worker processes.  More than one converts each archive "
+                                             "member in a separate process and merges the results",
+                        type=int, default=1)
+    parser.add_argument("-w", "--workdir", help="Directory for per-file partial outputs (default: temporary, or "
+                                                "<output>.parts with --incremental)")
+    parser.add_argument("-i", "--incremental", help="Only convert archive members that changed since the last run",
+                        action="store_true")
+    parser.add_argument("--shard", help="Split the output into one file per top concept, named "
+                                        "<output>.<concept>.<part>.<ext>, and list them in <output>-manifest.json",
+                        action="store_true")
+    parser.add_argument("--shard-size", help="Maximum triples per shard file (0: no limit).  Implies --shard",
+                        type=int, default=0)
+    parser.add_argument("--gzip", help="Compress the shard files.  Implies --shard", action="store_true")
+    parser.add_argument("--profile", help="Capture a cProfile of the run in <output>.prof", action="store_true")
+    parser.add_argument("--tracemalloc", help="Trace memory allocation and add the top allocators to the run report",
+                        action="store_true")
+    opts = parser.parse_args(argv)
+    opts.shard = opts.shard or opts.shard_size > 0 or opts.gzip
+    if opts.shard and opts.format == 'compact':
+        parser.error("--shard requires an 'nt', 'ttl' or 'graph' (turtle) format")
+    return opts
+
+
+def output_file(opts: argparse.Namespace) -> str:
+    """ Return the file that stands for the output -- the manifest when the output is sharded """
+    return manifest_file(shard_base(opts.output)) if opts.shard else opts.output
+
+
+def write_output(opts: argparse.Namespace, producer: Callable[[Union[Graph, TripleSink]], Union[Graph, TripleSink]]) \
+        -> None:
+    """
+    Write the triples generated by producer to opts.output in opts.format
+    :param opts: parsed arguments
+    :param producer: function that adds the triples to a graph or sink
+    """
+    def bind(sink: TripleSink) -> TripleSink:
+        for prefix, ns in namespaces.items():
+            sink.bind(prefix.lower(), ns)
+        sink.bind('skos', SKOS)
+        sink.bind('dcterms', DCTERMS)
+        return sink
+
+    if opts.shard:
+        sink = bind(ShardedSink(shard_base(opts.output), 'nt' if opts.format == 'nt' else 'ttl', opts.shard_size,
+                                opts.gzip))
+        producer(sink)
+        with metrics.stage('serialize'):
+            sink.close()
+        ntriples = len(sink)
+        metrics.count('serialize', 'shards', len(sink.shards))
+    elif opts.format == 'graph':
+        g = producer(Graph())
+        with metrics.stage('serialize'):
+            g.serialize(opts.output, format='ttl')
+        ntriples = len(g)
+    elif opts.format == 'compact':
+        sink = bind(CompactSink(opts.output))
+        producer(sink)
+        with metrics.stage('serialize'):
+            sink.close()
+        ntriples = len(sink)
+    else:
+        with open(opts.output, 'w', encoding='utf-8') as outf:
+            with bind(open_sink(outf, opts.format)) as sink:
+                producer(sink)
+        ntriples = len(sink)
+    metrics.count('serialize', 'triples', ntriples)
+    print(f"{ntriples} triples written to {output_file(opts)}")
+
+
+def build_from_partials(opts: argparse.Namespace, work_dir: str) -> None:
+    """
+    Convert the archive members into partial files in work_dir and merge them into opts.output
+    :param opts: parsed arguments
+    :param work_dir: directory for the partial outputs
+    """
+    fingerprints = FingerprintStore(os.path.join(work_dir, FINGERPRINT_FILE)) if opts.incremental else None
+    partials = convert_partials(opts.datadir, work_dir, opts.jobs, fingerprints)
+    if fingerprints is not None:
+        shard_opts = [f"shard:{opts.shard_size}:{opts.gzip}"] if opts.shard else []
+        output_fp = combine([fingerprints.get(p) for p in partials] + [opts.format] + shard_opts)
+        if fingerprints.unchanged(opts.output, output_fp, [output_file(opts)]):
+            print(f"{output_file(opts)} is up to date")
+            return
+    write_output(opts, lambda g: merge_partials(partials, g))
+    if fingerprints is not None:
+        fingerprints.record(opts.output, output_fp, [output_file(opts)])
+        fingerprints.save()
+
+
+def main(argv: List[str]) -> None:
+    opts = parse_args(argv)
+    metrics.start_capture(opts.profile, opts.tracemalloc)
+    if opts.incremental and not opts.workdir:
+        opts.workdir = opts.output + '.parts'
+    if opts.workdir:
+        build_from_partials(opts, opts.workdir)
+    elif opts.jobs > 1:
+        with TemporaryDirectory() as work_dir:
+            build_from_partials(opts, work_dir)
+    else:
+        write_output(opts, lambda g: convert(opts.datadir, g))
+    print(code_resolver.report())
+    metrics.stop_capture(os.path.splitext(opts.output)[0] + '.prof')
+    metrics.write(report_file(opts.output))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
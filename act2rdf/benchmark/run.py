@@ -0,0 +1,268 @@
+import argparse
+import gc
+import json
+import os
+import resource
+import sys
+import time
+from csv import DictReader
+from io import TextIOWrapper
+from tempfile import TemporaryDirectory
+from dataclasses import replace
+from typing import Dict, List, Any
+from zipfile import ZipFile
+
+from rdflib import URIRef
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from act2rdf.act2rdf import read_rdf, convert_member, merge_partials
+from act2rdf.benchmark.synthetic import SyntheticSpec, write_act_zip, write_i2b2_sqlite, SQLiteI2B2Tables, \
+    ROOT_PATH, TABLE_NAME, generate_concepts, code_generators
+from ontology import act_to_skos
+from ontology.closure import add_value_set_members, MemberClosure
+from ontology.codesystem_membership import CodeValidator
+from compactstore import CompactSink, CompactGraph
+from triplesink import NTriplesSink
+
+DEFAULT_TOLERANCE = 0.2         # Fractional slowdown against the baseline that counts as a regression
+SCALING_TOLERANCE = 0.5         # Fractional change in closure rate or bytes per concept when the tree doubles that
+                                # counts as superlinear
+
+
+def peak_rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Stage:
+    """ Time a single benchmark stage """
+    def __init__(self, results: Dict[str, Dict[str, Any]], name: str, unit: str) -> None:
+        self.results = results
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.extra: Dict[str, Any] = dict()
+
+    def __enter__(self) -> "Stage":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_) -> None:
+        elapsed = time.perf_counter() - self.start
+        self.results[self.name] = dict(seconds=round(elapsed, 4), items=self.items, unit=self.unit,
+                                       rate=round(self.items / elapsed, 1) if elapsed else 0.0,
+                                       peak_rss_kb=peak_rss_kb(), **self.extra)
+        print(f"{self.name:>14}: {self.items:>9} {self.unit} in {elapsed:8.3f}s "
+              f"({self.results[self.name]['rate']:,.0f} {self.unit}/sec)")
+
+
+def bench_act_file(spec: SyntheticSpec, work_dir: str, results: Dict[str, Dict[str, Any]]) -> None:
+    """ Benchmark the ACT archive converter (act2rdf.read_rdf) """
+    zip_path = os.path.join(work_dir, 'ACT_SYNTHETIC.zip')
+    write_act_zip(zip_path, spec)
+    with ZipFile(zip_path) as zf:
+        member = zf.infolist()[0]
+        with Stage(results, 'parse', 'rows') as stage:
+            with zf.open(member) as infile:
+                for _ in DictReader(TextIOWrapper(infile, 'utf-8'), delimiter='|'):
+                    stage.items += 1
+        with Stage(results, 'hierarchy', 'triples') as stage:
+            with zf.open(member) as infile, open(os.devnull, 'w') as devnull:
+                with NTriplesSink(devnull) as sink:
+                    read_rdf(DictReader(TextIOWrapper(infile, 'utf-8'), delimiter='|'), sink)
+            stage.items = len(sink)
+        bench_roundtrip(zip_path, member.filename, work_dir, results)
+
+
+def bench_roundtrip(zip_path: str, member: str, work_dir: str, results: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Write the N-Triples partial of an archive member (as the --jobs workers do) and parse it back, then do the same
+    for the N-Triples form of a compact store built from it
+    """
+    partial = os.path.join(work_dir, 'roundtrip.nt')
+    compact = os.path.join(work_dir, 'roundtrip.a2c')
+    compact_nt = os.path.join(work_dir, 'roundtrip_compact.nt')
+    with Stage(results, 'roundtrip', 'triples') as stage:
+        _, ntriples, _, _ = convert_member(zip_path, member, partial)
+        with CompactSink(compact) as compact_sink:
+            merge_partials([partial], compact_sink)
+        with CompactGraph(compact) as cg, open(compact_nt, 'w', encoding='utf-8') as out:
+            cg.serialize(out, 'nt')
+        for path in (partial, compact_nt):
+            with open(os.devnull, 'w') as devnull:
+                with NTriplesSink(devnull) as sink:
+                    merge_partials([path], sink)
+            if len(sink) != ntriples:
+                raise ValueError(f"{path}: {ntriples} triples written but {len(sink)} read back")
+            stage.items += len(sink)
+
+
+def bench_ontology_table(spec: SyntheticSpec, work_dir: str, results: Dict[str, Dict[str, Any]]) -> None:
+    """ Benchmark the i2b2 ontology converter (act_to_skos) """
+    ont_path, crc_path = os.path.join(work_dir, 'ont.db'), os.path.join(work_dir, 'crc.db')
+    write_i2b2_sqlite(ont_path, crc_path, spec)
+    queries = act_to_skos.QueryTexts(SQLiteI2B2Tables(ont_path, crc_path))
+    nqueries = [0]
+
+    def count_query(*_) -> None:
+        nqueries[0] += 1
+
+    g = act_to_skos.new_graph()
+    event.listen(Engine, 'before_cursor_execute', count_query)
+    try:
+        with Stage(results, 'valueset_sql', 'rows') as stage:
+            stage.items = act_to_skos.proc_ontology_table(queries, TABLE_NAME, act_to_skos.ACT['Synthetic/V1'],
+                                                          ROOT_PATH, g)
+            stage.extra['queries'] = nqueries[0]
+            stage.extra['statements'] = queries.stats()
+    finally:
+        event.remove(Engine, 'before_cursor_execute', count_query)
+    results['valueset_sql']['queries_per_sec'] = \
+        round(nqueries[0] / results['valueset_sql']['seconds'], 1) if results['valueset_sql']['seconds'] else 0.0
+    with Stage(results, 'closure', 'triples') as stage:
+        stage.items = add_value_set_members(g)
+    with Stage(results, 'serialize', 'triples') as stage:
+        with open(os.devnull, 'w') as devnull:
+            g.serialize(devnull, format='turtle')
+        stage.items = len(g)
+
+
+def bench_closure_scaling(spec: SyntheticSpec, _: str, results: Dict[str, Dict[str, Any]]) -> None:
+    """ Time the membership closure on a tree of spec.rows concepts (one code each) and on one twice the size """
+    def uri(path: str) -> URIRef:
+        return URIRef('http://example.org/synthetic' + path.replace('\\', '/'))
+
+    for name, rows in (('closure_1x', spec.rows), ('closure_2x', 2 * spec.rows)):
+        concepts = [(uri(c.fullname), uri(c.fullname.rsplit('\\', 2)[0] + '\\'),
+                     URIRef('http://example.org/code/' + c.basecode.replace(' ', '_')))
+                    for c in generate_concepts(replace(spec, rows=rows, depth=max(spec.depth, 12)))]
+        gc.collect()
+        with Stage(results, name, 'concepts') as stage:
+            closure = MemberClosure()
+            for concept, parent, code in concepts:
+                closure.add_broader(concept, parent)
+                closure.add_exact_match(concept, code)
+            closure.compute()
+            stage.items = len(closure.concepts)
+            distinct = {id(m): m for m in closure.members}.values()
+            stage.extra['member_bytes'] = sum(sys.getsizeof(m) for m in distinct)
+
+
+def check_scaling(results: Dict[str, Dict[str, Any]]) -> List[str]:
+    """
+    Check that the closure is linear in the size of the tree: the rate must not drop, nor the member set bytes per
+    concept grow, by more than SCALING_TOLERANCE when the tree doubles
+    :return: list of failures
+    """
+    small, large = results.get('closure_1x'), results.get('closure_2x')
+    if not small or not large:
+        return []
+    failures = []
+    if small['rate'] and large['rate'] < small['rate'] * (1 - SCALING_TOLERANCE):
+        failures.append(f"closure: {large['rate']:,.0f} concepts/sec for {large['items']} concepts vs. "
+                        f"{small['rate']:,.0f} for {small['items']} ({large['rate'] / small['rate'] - 1:+.0%})")
+    small_bytes, large_bytes = small['member_bytes'] / small['items'], large['member_bytes'] / large['items']
+    if large_bytes > small_bytes * (1 + SCALING_TOLERANCE):
+        failures.append(f"closure: {large_bytes:,.0f} member set bytes per concept for {large['items']} concepts vs. "
+                        f"{small_bytes:,.0f} for {small['items']} ({large_bytes / small_bytes - 1:+.0%})")
+    return failures
+
+
+def bench_validation(spec: SyntheticSpec, work_dir: str, results: Dict[str, Dict[str, Any]]) -> None:
+    """ Benchmark code validation """
+    codes = [c.basecode for c in generate_concepts(spec)]
+    validator = CodeValidator()
+    with Stage(results, 'validate', 'codes') as stage:
+        validator.validate(codes)
+        stage.items = len(codes)
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    """
+    Compare the stage rates against a baseline
+    :return: list of regressions
+    """
+    regressions = []
+    for name, base in baseline.get('stages', dict()).items():
+        current = results.get(name)
+        if current and base.get('rate') and current['rate'] < base['rate'] * (1 - tolerance):
+            regressions.append(f"{name}: {current['rate']:,.0f} {current['unit']}/sec vs. "
+                               f"baseline {base['rate']:,.0f} ({current['rate'] / base['rate'] - 1:+.0%})")
+    return regressions
+
+
+def parse_namespaces(text: str) -> Dict[str, float]:
+    """ Parse 'ICD10CM=3,LOINC=1' into a namespace weight map """
+    rslt = dict()
+    for entry in text.split(','):
+        ns, _, weight = entry.partition('=')
+        rslt[ns.strip()] = float(weight) if weight else 1.0
+    return rslt
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the ACT conversion pipeline on synthetic data",
+                                     prog="benchmark")
+    parser.add_argument("--rows", help="Number of ontology rows", type=int, default=10000)
+    parser.add_argument("--depth", help="Hierarchy depth", type=int, default=6)
+    parser.add_argument("--fanout", help="Children per concept", type=int, default=8)
+    parser.add_argument("--namespaces", help="Code namespace mix, e.g. ICD10CM=3,LOINC=1", default='ICD10CM=1')
+    parser.add_argument("--invalid", help="Fraction of invalid codes", type=float, default=0.01)
+    parser.add_argument("--seed", help="Random seed", type=int, default=42)
+    parser.add_argument("--stages", help="Benchmarks to run", nargs='+',
+                        default=['act', 'ontology', 'scaling', 'validate'],
+                        choices=['act', 'ontology', 'scaling', 'validate'])
+    parser.add_argument("--workdir", help="Directory for the generated data (default: temporary)")
+    parser.add_argument("-o", "--output", help="Write the results (JSON) to this file")
+    parser.add_argument("--baseline", help="Compare against the results in this file")
+    parser.add_argument("--save-baseline", help="Save the results as a new baseline in this file")
+    parser.add_argument("--tolerance", help="Allowed fractional slowdown against the baseline", type=float,
+                        default=DEFAULT_TOLERANCE)
+    opts = parser.parse_args(argv)
+    try:
+        unknown = parse_namespaces(opts.namespaces).keys() - code_generators.keys()
+    except ValueError as e:
+        parser.error(f"--namespaces: {e}")
+    if unknown:
+        parser.error(f"--namespaces: unknown namespace(s) {', '.join(sorted(unknown))} "
+                     f"(choose from {', '.join(code_generators)})")
+    return opts
+
+
+def run(opts: argparse.Namespace, work_dir: str) -> Dict[str, Any]:
+    spec = SyntheticSpec(opts.rows, opts.depth, opts.fanout, parse_namespaces(opts.namespaces), opts.invalid,
+                         opts.seed)
+    results: Dict[str, Dict[str, Any]] = dict()
+    benches = dict(act=bench_act_file, ontology=bench_ontology_table, scaling=bench_closure_scaling,
+                   validate=bench_validation)
+    for stage in opts.stages:
+        benches[stage](spec, work_dir, results)
+    return dict(spec=spec.__dict__, python=sys.version.split()[0], stages=results)
+
+
+def main(argv: List[str]) -> int:
+    opts = parse_args(argv)
+    if opts.workdir:
+        os.makedirs(opts.workdir, exist_ok=True)
+        report = run(opts, opts.workdir)
+    else:
+        with TemporaryDirectory() as work_dir:
+            report = run(opts, work_dir)
+    for path in (opts.output, opts.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+    failures = check_scaling(report['stages'])
+    for failure in failures:
+        print(f"SUPERLINEAR {failure}")
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            regressions = compare(report['stages'], json.load(f), opts.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        failures += regressions
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,183 @@
+import csv
+import io
+import os
+import random
+import sqlite3
+from argparse import Namespace
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Tuple, Callable
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from i2b2model.sqlsupport.i2b2tables import I2B2Tables
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+ROOT_PATH = '\\ACT\\Synthetic\\V1\\'      # table_access.c_fullname of the synthetic table
+TABLE_NAME = 'act_synthetic'
+ACT_COLUMNS = ['C_HLEVEL', 'C_FULLNAME', 'C_NAME', 'C_SYNONYM_CD', 'C_VISUALATTRIBUTES', 'C_TOTALNUM', 'C_BASECODE',
+               'C_METADATAXML', 'C_FACTTABLECOLUMN', 'C_TABLENAME', 'C_COLUMNNAME', 'C_COLUMNDATATYPE', 'C_OPERATOR',
+               'C_DIMCODE', 'C_COMMENT', 'C_TOOLTIP']
+
+
+def _digits(r: random.Random, n: int) -> str:
+    return ''.join(r.choice('0123456789') for _ in range(n))
+
+
+def _alnum(r: random.Random, n: int) -> str:
+    return ''.join(r.choice('0123456789ABCDEFGHJKLMNPQRSTUVWXYZ') for _ in range(n))
+
+
+# Generators of valid codes for each namespace known to codesystem_membership
+code_generators: Dict[str, Callable[[random.Random], str]] = {
+    'CPT4': lambda r: _digits(r, 5),
+    'HCPCS': lambda r: r.choice('ABCEGJ') + _digits(r, 4),
+    'ICD10CM': lambda r: r.choice('ABCDEFGHIJKLMN') + _digits(r, 2) + '.' + _alnum(r, r.randint(1, 3)),
+    'ICD10PCS': lambda r: _alnum(r, 7),
+    'ICD9CM': lambda r: _digits(r, 3) + '.' + _digits(r, r.randint(1, 2)),
+    'ICD9PROC': lambda r: _digits(r, 2) + '.' + _digits(r, r.randint(1, 2)),
+    'LOINC': lambda r: str(r.randint(1000, 99999)) + '-' + _digits(r, 1),
+    'NDC': lambda r: _digits(r, 11),
+    'RXNORM': lambda r: str(r.randint(1, 2000000)),
+    'UMLS': lambda r: 'C' + _digits(r, 7)
+}
+
+
+@dataclass
+class SyntheticSpec:
+    rows: int = 10000                   # Number of ontology rows
+    depth: int = 6                      # Maximum hierarchy depth below the root
+    fanout: int = 8                     # Children per non-leaf concept
+    namespaces: Dict[str, float] = field(default_factory=lambda: {'ICD10CM': 1.0})    # Code namespace mix (weights)
+    invalid_fraction: float = 0.01      # Fraction of codes that fail validation
+    multiline_every: int = 100          # Every n'th name has a line break and quotes.  0 means none
+    seed: int = 42
+
+
+@dataclass
+class SyntheticConcept:
+    level: int
+    fullname: str
+    name: str
+    basecode: str
+    leaf: bool
+
+
+def generate_concepts(spec: SyntheticSpec) -> Iterator[SyntheticConcept]:
+    """
+    Generate a breadth first synthetic ACT hierarchy under ROOT_PATH
+    :param spec: generation parameters
+    :return: concepts, parents before children
+    """
+    r = random.Random(spec.seed)
+    nss = list(spec.namespaces.keys())
+    weights = list(spec.namespaces.values())
+    todo = deque([(0, ROOT_PATH)])
+    nrows = 0
+    seq = 0
+    while todo and nrows < spec.rows:
+        level, path = todo.popleft()
+        if level >= spec.depth:
+            continue
+        for _ in range(spec.fanout):
+            if nrows >= spec.rows:
+                break
+            seq += 1
+            code = f"S{seq}"
+            fullname = f"{path}{code}\\"
+            ns = r.choices(nss, weights)[0]
+            local = code_generators[ns](r) if r.random() >= spec.invalid_fraction else 'INVALID ' + _alnum(r, 3)
+            leaf = level + 1 == spec.depth
+            nrows += 1
+            name = f'Synthetic "concept" {seq}\nsecond line' \
+                if spec.multiline_every and seq % spec.multiline_every == 0 else f"Synthetic concept {seq}"
+            yield SyntheticConcept(level + 1, fullname, name, f"{ns}:{local}", leaf)
+            if not leaf:
+                todo.append((level + 1, fullname))
+
+
+def act_row(c: SyntheticConcept) -> List[str]:
+    """ Return the ACT file / ontology table row for concept c, in ACT_COLUMNS order """
+    return [str(c.level), c.fullname, c.name, 'N', 'LA' if c.leaf else 'FA', '', c.basecode, '', 'concept_cd',
+            'concept_dimension', 'concept_path', 'T', 'LIKE', c.fullname, '', c.fullname]
+
+
+def write_act_zip(path: str, spec: SyntheticSpec) -> int:
+    """
+    Write a synthetic pipe delimited ACT archive
+    :param path: zip file to write
+    :param spec: generation parameters
+    :return: number of rows written
+    """
+    nrows = 0
+    member = os.path.splitext(os.path.basename(path))[0] + '.dsv'
+    with ZipFile(path, 'w', ZIP_DEFLATED) as zf:
+        with zf.open(member, 'w') as f, io.TextIOWrapper(f, 'utf-8', newline='') as out:
+            # Names with line breaks or quotes are quoted, as in the ACT distribution
+            writer = csv.writer(out, delimiter='|', lineterminator='\n')
+            writer.writerow(ACT_COLUMNS)
+            for c in generate_concepts(spec):
+                writer.writerow(act_row(c))
+                nrows += 1
+    return nrows
+
+
+def write_i2b2_sqlite(ont_path: str, crc_path: str, spec: SyntheticSpec) -> int:
+    """
+    Write synthetic i2b2 ontology (table_access + one ACT table) and CRC (concept_dimension) SQLite databases
+    :param ont_path: ontology database file
+    :param crc_path: CRC database file
+    :param spec: generation parameters
+    :return: number of ontology rows written
+    """
+    for p in (ont_path, crc_path):
+        if os.path.exists(p):
+            os.remove(p)
+    nrows = 0
+    with sqlite3.connect(ont_path) as ont, sqlite3.connect(crc_path) as crc:
+        ont.execute("CREATE TABLE table_access (c_table_cd TEXT, c_table_name TEXT, c_protected_access TEXT, "
+                    "c_hlevel INT, c_fullname TEXT, c_name TEXT, c_visualattributes TEXT, c_dimtablename TEXT)")
+        ont.execute("INSERT INTO table_access VALUES (?, ?, 'N', 0, ?, 'ACT Synthetic', 'CA', 'concept_dimension')",
+                    (TABLE_NAME.upper(), TABLE_NAME, ROOT_PATH))
+        ont.execute(f"CREATE TABLE {TABLE_NAME} ({', '.join(c.lower() + ' TEXT' for c in ACT_COLUMNS)})")
+        crc.execute("CREATE TABLE concept_dimension (concept_path TEXT, concept_cd TEXT, name_char TEXT)")
+        batch: List[Tuple[List[str], Tuple[str, str, str]]] = []
+
+        def flush() -> None:
+            ont.executemany(f"INSERT INTO {TABLE_NAME} VALUES ({', '.join('?' * len(ACT_COLUMNS))})",
+                            [b[0] for b in batch])
+            crc.executemany("INSERT INTO concept_dimension VALUES (?, ?, ?)", [b[1] for b in batch])
+            batch.clear()
+
+        for c in generate_concepts(spec):
+            batch.append((act_row(c), (c.fullname, c.basecode, c.name)))
+            nrows += 1
+            if len(batch) >= 10000:
+                flush()
+        flush()
+        ont.execute(f"CREATE INDEX {TABLE_NAME}_fullname ON {TABLE_NAME} (c_fullname)")
+        crc.execute("CREATE INDEX concept_dimension_path ON concept_dimension (concept_path)")
+    return nrows
+
+
+# Databases attached to every new SQLite connection as the i2b2 schemas
+_attached: Dict[str, str] = dict()
+
+
+@event.listens_for(Engine, 'connect')
+def _attach_i2b2_schemas(dbapi_connection, _) -> None:
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        for schema, path in _attached.items():
+            dbapi_connection.execute(f"ATTACH DATABASE '{path}' AS {schema}")
+
+
+class SQLiteI2B2Tables(I2B2Tables):
+    """ I2B2Tables over a pair of SQLite databases, attached under the i2b2 schema names """
+    def __init__(self, ont_path: str, crc_path: str) -> None:
+        _attached[I2B2Tables.i2b2metadata] = os.path.abspath(ont_path)
+        _attached[I2B2Tables.i2b2crc] = os.path.abspath(crc_path)
+        super().__init__(Namespace())
+
+    @staticmethod
+    def _db_urls(opts: Namespace) -> Tuple[str, str]:
+        return 'sqlite://', 'sqlite://'
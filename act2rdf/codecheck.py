@@ -0,0 +1,70 @@
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Any
+
+CACHE_SIZE = 200000             # Number of distinct codes to remember
+NUM_EXAMPLES = 5                # Number of failing codes to list per namespace in the report
+
+
+class CodeChecker:
+    """
+    Base for the classes that check namespace:code strings (CodeResolver, CodeValidator).  Outcomes of repeated codes
+    come from a bounded cache and failures are tallied by outcome and namespace, with a few example codes each, for a
+    summary report rather than printed one at a time.
+    :param cache_size: number of distinct codes to cache
+    """
+    failure_title = "Code failures"
+    success_message = "All codes passed"
+
+    def __init__(self, cache_size: int = CACHE_SIZE) -> None:
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+        self.counts: Counter = Counter()
+        self.examples: Dict[Tuple[str, Optional[str]], List[str]] = dict()
+
+    def _classify(self, code: str) -> Tuple:
+        """ Return the outcome of checking code and its namespace prefix, followed by anything else of use """
+        raise NotImplementedError
+
+    def tally(self, outcome: str, ns: Optional[str], code: str) -> None:
+        """ Record a code that failed with outcome """
+        self.counts[(outcome, ns)] += 1
+        examples = self.examples.setdefault((outcome, ns), [])
+        if len(examples) < NUM_EXAMPLES and code not in examples:
+            examples.append(code)
+
+    def _sorted_counts(self) -> List[Tuple[Tuple[str, Optional[str]], int]]:
+        return sorted(self.counts.items(), key=lambda e: (e[0][0], e[0][1] or ''))
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        """ Return the failure counts by outcome and namespace """
+        rslt: Dict[str, Dict[str, int]] = dict()
+        for (outcome, ns), n in self._sorted_counts():
+            rslt.setdefault(outcome, dict())[ns or ''] = n
+        return rslt
+
+    def report(self) -> str:
+        """ Return a printable summary of the codes that failed """
+        lines = []
+        for (outcome, ns), n in self._sorted_counts():
+            label = f"{outcome} {ns}" if ns else outcome
+            lines.append(f"  {label}: {n} (e.g. {', '.join(self.examples.get((outcome, ns), []))})")
+        return '\n'.join([self.failure_title + ':'] + lines) if lines else self.success_message
+
+    def tallies(self) -> Dict[str, Any]:
+        """ Return the failure counts and examples in a form that can be passed between processes """
+        return dict(counts=[[outcome, ns, n] for (outcome, ns), n in self.counts.items()],
+                    examples=[[outcome, ns, codes] for (outcome, ns), codes in self.examples.items()])
+
+    def merge(self, tallies: Dict[str, Any]) -> None:
+        """ Add the tallies of another checker (e.g. in a worker process) """
+        for outcome, ns, n in tallies['counts']:
+            self.counts[(outcome, ns)] += n
+        for outcome, ns, codes in tallies['examples']:
+            examples = self.examples.setdefault((outcome, ns), [])
+            examples.extend(c for c in codes if c not in examples)
+            del examples[NUM_EXAMPLES:]
+
+    def reset(self) -> None:
+        """ Clear the failure counts (the outcome cache is kept) """
+        self.counts.clear()
+        self.examples.clear()
@@ -0,0 +1,67 @@
+from typing import Dict, List, Iterable, Optional, Tuple
+
+from rdflib import Namespace, URIRef
+
+from codecheck import CodeChecker, CACHE_SIZE
+
+# Local name characters that can't appear in an IRI, and their replacement.  Used for ACT concepts and codes alike
+LOCAL_NAME_MAP = str.maketrans({' ': '_', '|': '%7C'})
+
+# Resolution outcomes
+RESOLVED = 'resolved'
+UNKNOWN_NS = 'unknown namespace'
+MALFORMED = 'malformed'
+
+
+def local_name(name: str) -> str:
+    """ Return name (an ACT path segment or the code part of a basecode) as an IRI local name """
+    return name.translate(LOCAL_NAME_MAP)
+
+
+class CodeResolver(CodeChecker):
+    """
+    Maps namespace:code strings to URIs.  The namespace table is precomputed to plain strings, local names are
+    normalized once per distinct code and the resulting URIRefs come from a bounded cache.  Codes that can't be
+    resolved are tallied by outcome and namespace (see CodeChecker).
+    :param namespaces: prefix to namespace map
+    :param unknown: namespace for codes with an unrecognized prefix.  If absent, they don't resolve.
+    :param cache_size: number of distinct codes to cache
+    """
+    failure_title = "Code resolution failures"
+    success_message = "All codes resolved"
+
+    def __init__(self, namespaces: Dict[str, Namespace], unknown: Optional[Namespace] = None,
+                 cache_size: int = CACHE_SIZE) -> None:
+        super().__init__(cache_size)
+        self.namespaces = {prefix: str(ns) for prefix, ns in namespaces.items()}
+        self.unknown = str(unknown) if unknown is not None else None
+
+    def _classify(self, code: str) -> Tuple[str, Optional[str], Optional[URIRef]]:
+        """ Return the outcome of resolving code, its namespace prefix and its URI """
+        ns, sep, local = code.partition(':')
+        if not sep or not local or ':' in local:
+            return MALFORMED, None, None
+        base = self.namespaces.get(ns)
+        if base is None:
+            if self.unknown is None:
+                return UNKNOWN_NS, ns, None
+            return UNKNOWN_NS, ns, URIRef(self.unknown + local.translate(LOCAL_NAME_MAP))
+        return RESOLVED, ns, URIRef(base + local.translate(LOCAL_NAME_MAP))
+
+    def resolve(self, code: str) -> Optional[URIRef]:
+        """
+        Return the URI of code
+        :param code: namespace:code string.  Blank codes are ignored
+        :return: URI or None if code is blank or doesn't resolve
+        """
+        if not code or code.isspace():
+            return None
+        outcome, ns, uri = self.classify(code)
+        if outcome is not RESOLVED:
+            self.tally(outcome, ns, code)
+        return uri
+
+    def resolve_many(self, codes: Iterable[str]) -> List[Optional[URIRef]]:
+        """ Resolve a batch of codes """
+        resolve = self.resolve
+        return [resolve(code) for code in codes]
@@ -0,0 +1,271 @@
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterator, Optional, TextIO, Tuple, List
+
+from rdflib import Namespace, RDF
+from rdflib.term import Node
+from rdflib.util import from_n3
+
+from termcache import LRUCache
+from triplesink import TripleSink, Triple, PNAME_LOCAL_RE, node_n3
+
+# Compact store layout.  All sections are in native byte order and 8 byte aligned:
+#    header      magic(4) version(4) nterms(8) ntriples(8) blob length(8) prefixes length(8)
+#    prefixes    utf-8 "prefix namespace" lines for the bound namespaces
+#    offsets     nterms + 1 unsigned 64 bit offsets into the term blob
+#    blob        utf-8 N-Triples form of each term, sorted
+#    spo         three columns of ntriples unsigned 32 bit term ids -- s, p and o, sorted by (s, p, o)
+#    pos         three columns of ntriples unsigned 32 bit term ids -- p, o and s, sorted by (p, o, s)
+MAGIC = b'A2RC'
+VERSION = 1
+HEADER = struct.Struct('=4sIQQQQ')
+COMPACT_EXT = '.a2c'
+QNAME_CACHE_SIZE = 100000       # Term ids whose turtle form is kept while serializing
+
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+
+
+def _pad(n: int) -> int:
+    return (8 - n % 8) % 8
+
+
+class CompactSink(TripleSink):
+    """
+    Collect triples as term ids and write them as a compact store when closed.  Duplicates are removed when the
+    triples are sorted, so no digest set is kept.
+    """
+    def __init__(self, path: str) -> None:
+        super().__init__(dedup=False)
+        self.path = path
+        self.term_ids: Dict[str, int] = dict()
+        self.columns = (array('I'), array('I'), array('I'))
+
+    def _id(self, t: Node) -> int:
+        n3 = self.n3[t]
+        tid = self.term_ids.get(n3)
+        if tid is None:
+            tid = self.term_ids[n3] = len(self.term_ids)
+        return tid
+
+    def _write(self, triple: Triple) -> None:
+        for column, t in zip(self.columns, triple):
+            column.append(self._id(t))
+
+    def close(self) -> None:
+        terms = sorted(self.term_ids)
+        remap = array('I', bytes(4 * len(terms)))
+        for new_id, term in enumerate(terms):
+            remap[self.term_ids[term]] = new_id
+        self.term_ids = dict()
+
+        s, p, o = ([remap[i] for i in column] for column in self.columns)
+        self.columns = (array('I'), array('I'), array('I'))
+        # Triples are packed into a single int per sort order -- far smaller than a tuple
+        spo = sorted({(si << ID_BITS * 2) | (pi << ID_BITS) | oi for si, pi, oi in zip(s, p, o)})
+        pos = sorted((pi << ID_BITS * 2) | (oi << ID_BITS) | si for si, pi, oi in zip(s, p, o))
+        pos = [k for i, k in enumerate(pos) if not i or k != pos[i - 1]]
+        self.ntriples = len(spo)
+        write_store(self.path, terms, spo, pos, self.namespaces)
+
+
+def write_store(path: str, terms: List[str], spo: List[int], pos: List[int],
+                namespaces: Optional[Dict[str, Namespace]] = None) -> None:
+    """
+    Write a compact store
+    :param path: output file
+    :param terms: sorted term strings
+    :param spo: packed (s, p, o) ids, sorted
+    :param pos: packed (p, o, s) ids, sorted
+    :param namespaces: prefixes to record for later serialization
+    """
+    prefixes = ''.join(f"{prefix} {ns}\n" for prefix, ns in (namespaces or dict()).items()).encode('utf-8')
+    blob = bytearray()
+    offsets = array('Q', [0])
+    for term in terms:
+        blob += term.encode('utf-8')
+        offsets.append(len(blob))
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(terms), len(spo), len(blob), len(prefixes)))
+        f.write(prefixes)
+        f.write(bytes(_pad(len(prefixes))))
+        f.write(offsets.tobytes())
+        f.write(blob)
+        f.write(bytes(_pad(len(blob))))
+        for packed in (spo, pos):
+            for shift in (ID_BITS * 2, ID_BITS, 0):
+                f.write(array('I', [(k >> shift) & ID_MASK for k in packed]).tobytes())
+            f.write(bytes(_pad(4 * len(packed))))
+
+
+class _Terms:
+    """ Sequence view of the term dictionary, used to binary search for a term """
+    def __init__(self, offsets: memoryview, blob: memoryview) -> None:
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+
+class CompactGraph:
+    """ Read-only, memory-mapped view of a compact store """
+    def __init__(self, path: str) -> None:
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._map)
+        magic, version, nterms, ntriples, bloblen, prefixlen = HEADER.unpack_from(buf)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} compact store")
+        pos = HEADER.size
+        self.namespaces: Dict[str, Namespace] = dict()
+        for line in bytes(buf[pos:pos + prefixlen]).decode('utf-8').splitlines():
+            prefix, ns = line.split(' ', 1)
+            self.namespaces[prefix] = Namespace(ns)
+        pos += prefixlen + _pad(prefixlen)
+        offsets = buf[pos:pos + 8 * (nterms + 1)].cast('Q')
+        pos += 8 * (nterms + 1)
+        blob = buf[pos:pos + bloblen]
+        pos += bloblen + _pad(bloblen)
+        self.terms = _Terms(offsets, blob)
+        self.ntriples = ntriples
+        columns = []
+        for _ in range(2):
+            for _ in range(3):
+                columns.append(buf[pos:pos + 4 * ntriples].cast('I'))
+                pos += 4 * ntriples
+            pos += _pad(4 * ntriples)
+        self.s, self.p, self.o = columns[:3]
+        self.pos_p, self.pos_o, self.pos_s = columns[3:]
+
+    def close(self) -> None:
+        for v in (self.s, self.p, self.o, self.pos_p, self.pos_o, self.pos_s, self.terms.offsets, self.terms.blob):
+            v.release()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self) -> "CompactGraph":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.ntriples
+
+    def term_id(self, node: Node) -> Optional[int]:
+        """ Return the id of node or None if it isn't in the store """
+        n3 = node_n3(node)
+        i = bisect_left(self.terms, n3)
+        return i if i < len(self.terms) and self.terms[i] == n3 else None
+
+    def node(self, tid: int) -> Node:
+        return from_n3(self.terms[tid])
+
+    def triple_ids(self, pattern: Tuple[Optional[Node], Optional[Node], Optional[Node]]) \
+            -> Iterator[Tuple[int, int, int]]:
+        """ Return the (s, p, o) ids of the triples matching pattern.  None matches anything """
+        ids = []
+        for t in pattern:
+            tid = self.term_id(t) if t is not None else None
+            if t is not None and tid is None:
+                return
+            ids.append(tid)
+        s, p, o = ids
+        if s is not None:
+            lo, hi = bisect_left(self.s, s), bisect_right(self.s, s)
+            if p is not None:
+                lo, hi = bisect_left(self.p, p, lo, hi), bisect_right(self.p, p, lo, hi)
+            for i in range(lo, hi):
+                if o is None or self.o[i] == o:
+                    yield self.s[i], self.p[i], self.o[i]
+        elif p is not None:
+            lo, hi = bisect_left(self.pos_p, p), bisect_right(self.pos_p, p)
+            if o is not None:
+                lo, hi = bisect_left(self.pos_o, o, lo, hi), bisect_right(self.pos_o, o, lo, hi)
+            for i in range(lo, hi):
+                yield self.pos_s[i], self.pos_p[i], self.pos_o[i]
+        else:
+            for i in range(self.ntriples):
+                if o is None or self.o[i] == o:
+                    yield self.s[i], self.p[i], self.o[i]
+
+    def triples(self, pattern: Tuple[Optional[Node], Optional[Node], Optional[Node]]) -> Iterator[Triple]:
+        for s, p, o in self.triple_ids(pattern):
+            yield self.node(s), self.node(p), self.node(o)
+
+    def objects(self, subject: Node, predicate: Node) -> Iterator[Node]:
+        for _, _, o in self.triple_ids((subject, predicate, None)):
+            yield self.node(o)
+
+    def subjects(self, predicate: Node, obj: Node) -> Iterator[Node]:
+        for s, _, _ in self.triple_ids((None, predicate, obj)):
+            yield self.node(s)
+
+    def serialize(self, out: TextIO, fmt: str = 'nt', namespaces: Optional[Dict[str, Namespace]] = None) -> int:
+        """
+        Write the store as N-Triples or Turtle (grouped by subject) without building any rdflib terms
+        :param out: output stream
+        :param fmt: 'nt' or 'ttl'
+        :param namespaces: prefixes to use for Turtle.  Default: the prefixes recorded in the store
+        :return: number of triples written
+        """
+        terms = self.terms
+        if fmt == 'nt':
+            for i in range(self.ntriples):
+                out.write(f"{terms[self.s[i]]} {terms[self.p[i]]} {terms[self.o[i]]} .\n")
+            return self.ntriples
+        if fmt != 'ttl':
+            raise ValueError(f"Unrecognized format: {fmt}")
+        prefixes = sorted(((str(ns), prefix) for prefix, ns in (namespaces or self.namespaces).items()),
+                          key=lambda e: len(e[0]), reverse=True)
+        for ns, prefix in sorted(prefixes, key=lambda e: e[1]):
+            out.write(f"@prefix {prefix}: <{ns}> .\n")
+        out.write('\n')
+
+        def mk_qname(tid: int) -> str:
+            rslt = terms[tid]
+            if rslt.startswith('<'):
+                iri = rslt[1:-1]
+                for ns, prefix in prefixes:
+                    if iri.startswith(ns):
+                        local = iri[len(ns):]
+                        if PNAME_LOCAL_RE.match(local) and not local.endswith('.'):
+                            rslt = f"{prefix}:{local}"
+                        break
+            return rslt
+        qname = LRUCache(mk_qname, QNAME_CACHE_SIZE).__getitem__
+
+        type_id = self.term_id(RDF.type)
+        subj = None
+        for i in range(self.ntriples):
+            s, p = self.s[i], self.p[i]
+            pred = 'a' if p == type_id else qname(p)
+            if s == subj:
+                out.write(f" ;\n    {pred} {qname(self.o[i])}")
+            else:
+                if subj is not None:
+                    out.write(' .\n\n')
+                subj = s
+                out.write(f"{qname(s)} {pred} {qname(self.o[i])}")
+        if subj is not None:
+            out.write(' .\n')
+        return self.ntriples
+
+
+def main(argv: List[str]) -> None:
+    """ Reformat a compact store: compactstore.py <input.a2c> <output.nt|output.ttl> """
+    infile, outfile = argv
+    with CompactGraph(infile) as g, open(outfile, 'w', encoding='utf-8') as out:
+        n = g.serialize(out, 'ttl' if outfile.endswith('.ttl') else 'nt')
+    print(f"{n} triples written to {outfile}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Iterable
+from zipfile import ZipFile
+
+from sqlalchemy import Table
+from sqlalchemy.orm import Session
+
+FINGERPRINT_FILE = 'fingerprints.json'
+
+
+class FingerprintStore:
+    """
+    Record of the fingerprint of each conversion input and the outputs generated from it.  An input whose fingerprint
+    is unchanged and whose outputs still exist does not need to be converted again.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.entries: Dict[str, Dict] = dict()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        return entry['fingerprint'] if entry else None
+
+    def unchanged(self, key: str, fingerprint: str, outputs: List[str]) -> bool:
+        """
+        Determine whether key needs to be regenerated
+        :param key: input identifier
+        :param fingerprint: current fingerprint of the input
+        :param outputs: files generated from the input
+        :return: True if the fingerprint matches the recorded one and all of the outputs exist
+        """
+        entry = self.entries.get(key)
+        return entry is not None and entry['fingerprint'] == fingerprint and \
+            sorted(entry['outputs']) == sorted(outputs) and all(os.path.exists(o) for o in outputs)
+
+    def record(self, key: str, fingerprint: str, outputs: List[str]) -> None:
+        self.entries[key] = dict(fingerprint=fingerprint, outputs=outputs)
+
+    def save(self) -> None:
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+def combine(fingerprints: Iterable[Optional[str]]) -> str:
+    """ Return a single fingerprint for a collection of fingerprints """
+    h = hashlib.sha1()
+    for fp in fingerprints:
+        h.update((fp or '').encode('utf-8'))
+        h.update(b'\n')
+    return h.hexdigest()
+
+
+def zip_member_fingerprint(zip_path: str, member: str) -> str:
+    """ Return the fingerprint of an archive member from the CRC and size recorded in the archive directory """
+    with ZipFile(zip_path) as zf:
+        info = zf.getinfo(member)
+    return f"{info.CRC:08x}:{info.file_size}"
+
+
+def table_fingerprint(session: Session, table: Table, columns: List[str]) -> str:
+    """
+    Return the fingerprint of a database table from its row count and a checksum over columns.  The checksum is the
+    sum of the row digests, so it doesn't depend on row order and the table is read with a plain scan -- there is no
+    ORDER BY for the database to sort.  The scan still reads every row of the table.
+    :param session: session to query with
+    :param table: table to fingerprint
+    :param columns: columns that contribute to the checksum
+    :return: fingerprint
+    """
+    total = 0
+    nrows = 0
+    for row in session.query(*[table.c[c] for c in columns]).yield_per(10000):
+        digest = hashlib.sha1('|'.join('' if v is None else str(v) for v in row).encode('utf-8')).digest()
+        total += int.from_bytes(digest[:16], 'little')
+        nrows += 1
+    return f"{nrows}:{total % (1 << 128):032x}"
@@ -0,0 +1,69 @@
+from collections import deque
+from typing import Dict, Hashable, List, Set, Tuple, Sequence
+
+
+class PathIndex:
+    """
+    Hierarchy edges already emitted from ACT C_FULLNAME paths.  Adding a path returns only the (child, parent) edges
+    that haven't been seen before, so each edge is emitted once rather than once per descendant row.  The index keeps
+    the children and parents of each node, so it can also answer ancestor and descendant queries once it is built.
+    Nodes are path segments, or any other hashable term when edges are added directly (see add_edge).
+    """
+    def __init__(self) -> None:
+        self.children: Dict[Hashable, Set[Hashable]] = dict()
+        self.parents: Dict[Hashable, Set[Hashable]] = dict()
+        self.last_path: Sequence[Hashable] = ()
+
+    def add_edge(self, child: Hashable, parent: Hashable) -> bool:
+        """ Record child skos:broader parent.  Return True if the edge is new """
+        siblings = self.children.get(parent)
+        if siblings is None:
+            siblings = self.children[parent] = set()
+        elif child in siblings:
+            return False
+        siblings.add(child)
+        self.parents.setdefault(child, set()).add(parent)
+        return True
+
+    def add_path(self, nodes: Sequence[str]) -> List[Tuple[str, str]]:
+        """
+        Record path nodes (root first).  Every edge in the prefix shared with the previous path has already been
+        recorded, so only the remaining suffix is walked -- for a file in C_FULLNAME order, usually just the last edge.
+        :param nodes: path segments, e.g. ['ACT', 'Diagnosis', 'A20098492']
+        :return: list of (child, parent) edges that have not been seen before
+        """
+        last = self.last_path
+        shared = 0
+        for a, b in zip(nodes, last):
+            if a != b:
+                break
+            shared += 1
+        self.last_path = nodes
+        # The same edge can still occur in a different branch of the tree (polyhierarchy), so the suffix is checked
+        add_edge = self.add_edge
+        return [(nodes[i], nodes[i - 1]) for i in range(max(shared, 1), len(nodes))
+                if add_edge(nodes[i], nodes[i - 1])]
+
+    def roots(self) -> List[Hashable]:
+        """ Return the nodes that have children but no parents """
+        return [node for node in self.children if node not in self.parents]
+
+    def _closure(self, node: Hashable, edges: Dict[Hashable, Set[Hashable]]) -> List[Hashable]:
+        rslt = []
+        seen = {node}
+        todo = deque([node])
+        while todo:
+            for n in edges.get(todo.popleft(), ()):
+                if n not in seen:
+                    seen.add(n)
+                    rslt.append(n)
+                    todo.append(n)
+        return rslt
+
+    def ancestors(self, node: Hashable) -> List[Hashable]:
+        """ Return the ancestors of node, nearest first """
+        return self._closure(node, self.parents)
+
+    def descendants(self, node: Hashable) -> List[Hashable]:
+        """ Return the descendants of node, breadth first """
+        return self._closure(node, self.children)
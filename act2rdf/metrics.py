@@ -0,0 +1,114 @@
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Iterator, List
+
+
+class RunMetrics:
+    """
+    Lightweight run instrumentation.  Stages accumulate wall clock time and call counts, counters are kept per stage
+    (e.g. ('valueset_sql', 'queries')) and turned into rates against the stage time, and units (a table or a file)
+    record their own elapsed time and counter deltas.  cProfile and tracemalloc capture can be switched on for a run.
+    """
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.seconds: Dict[str, float] = dict()
+        self.calls: Counter = Counter()
+        self.counts: Counter = Counter()
+        self.units: List[Dict[str, Any]] = []
+        self.profiler: Optional[cProfile.Profile] = None
+        self.tracing = False
+        self.memory: Dict[str, Any] = dict()
+
+    def reset(self) -> None:
+        """ Start over -- used by worker processes, which inherit the parent's state """
+        self.__init__()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+            self.calls[name] += 1
+
+    def count(self, stage: str, item: str, n: int = 1) -> None:
+        self.counts[(stage, item)] += n
+
+    @contextmanager
+    def unit(self, kind: str, name: str) -> Iterator[Dict[str, Any]]:
+        """ Record the elapsed time and counter deltas of a table, file, ... """
+        before = Counter(self.counts)
+        start = time.perf_counter()
+        entry: Dict[str, Any] = dict(kind=kind, name=name)
+        try:
+            yield entry
+        finally:
+            entry['seconds'] = round(time.perf_counter() - start, 3)
+            entry['counts'] = {f"{s}.{i}": n for (s, i), n in (self.counts - before).items()}
+            self.units.append(entry)
+
+    def start_capture(self, profile: bool = False, trace_memory: bool = False) -> None:
+        if profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        if trace_memory:
+            tracemalloc.start()
+            self.tracing = True
+
+    def stop_capture(self, profile_file: Optional[str] = None) -> None:
+        if self.profiler:
+            self.profiler.disable()
+            if profile_file:
+                self.profiler.dump_stats(profile_file)
+            self.profiler = None
+        if self.tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+            self.memory = dict(current_bytes=current, peak_bytes=peak,
+                               top=[dict(location=str(s.traceback), size=s.size, count=s.count) for s in top])
+            tracemalloc.stop()
+            self.tracing = False
+
+    def report(self) -> Dict[str, Any]:
+        stages = dict()
+        for name, seconds in self.seconds.items():
+            stages[name] = dict(seconds=round(seconds, 3), calls=self.calls[name])
+        for (stage, item), n in self.counts.items():
+            entry = stages.setdefault(stage, dict(seconds=0.0, calls=0))
+            entry[item] = n
+            if entry['seconds']:
+                entry[f"{item}_per_sec"] = round(n / entry['seconds'], 1)
+        rslt = dict(started=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                    elapsed=round(time.time() - self.started, 3), stages=stages, units=self.units)
+        if self.memory:
+            rslt['memory'] = self.memory
+        return rslt
+
+    def merge(self, report: Dict[str, Any]) -> None:
+        """ Add the report of a worker process """
+        for name, entry in report.get('stages', dict()).items():
+            self.seconds[name] = self.seconds.get(name, 0.0) + entry.get('seconds', 0.0)
+            self.calls[name] += entry.get('calls', 0)
+            for item, n in entry.items():
+                if item not in ('seconds', 'calls') and not item.endswith('_per_sec'):
+                    self.counts[(name, item)] += n
+        self.units.extend(report.get('units', []))
+
+    def write(self, path: str) -> None:
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+        print(f"Run report written to {path}")
+
+
+def report_file(output: str) -> str:
+    """ Return the name of the run report that goes with output """
+    return os.path.splitext(output)[0] + '-report.json'
+
+
+metrics = RunMetrics()
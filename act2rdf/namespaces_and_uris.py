@@ -4,6 +4,7 @@ from rdflib import Namespace, URIRef, OWL
 from rdflib.namespace import SKOS
 
 from act2rdf.accessinfo import NamespaceInfo, AccessInfo, ServiceType
+from coderesolver import CodeResolver
 
 # The namespaces table supplies the official namespaces for the various resources.  These namespaces form the URI
 # of the entity and may or may not resolve.  When in doubt, we refer the 'system' identifier in the FHIR specification
@@ -28,28 +29,32 @@ namespaces = {
 UNKNOWN = Namespace('http://UNKNOWN.NS/')
 
 
+code_resolver = CodeResolver(namespaces, UNKNOWN)
+
+
 def code_to_uri(code: str) -> URIRef:
-    ns, ln = code.split(':', 1)
-    return namespaces.get(ns, UNKNOWN)[ln]
-
-# namespaces: Dict[str, NamespaceInfo] = {
-#     'ACT': NamespaceInfo('act', 'https://ncatswiki.dbmi.pitt.edu/acts/ACT/'),
-#     'CPT4': NamespaceInfo('cpt4', 'http://www.ama-assn.org/go/cpt#'),
-#     'HCPCS': NamespaceInfo('hcpcs', 'http://purl.bioontology.org/ontology/HCPCS/'),
-#     'ICD10CM': NamespaceInfo('icd10cm', 'http://purl.bioontology.org/ontology/ICD10CM/'),
-#     'ICD10PCS': NamespaceInfo('icd10pcs', 'http://purl.bioontology.org/ontology/ICD10PCS/'),
-#     'ICD9CM': NamespaceInfo('icd9cm', 'http://purl.bioontology.org/ontology/ICD9CM/'),
-#     'RXNORM': NamespaceInfo('rxnorm', 'http://www.nlm.nih.gov/research/umls/rxnorm/'),
-#     'NDC': NamespaceInfo('ndc', 'https://identifiers.org/ndc:'),
-#     'NUI': NamespaceInfo('nui', 'http://example.org/NUI/'),
-#     'ICD9PROC': NamespaceInfo('icd9p', 'http://example.org/ICD9PROC/'),
-#     'LOINC': NamespaceInfo('loinc', 'http://purl.bioontology.org/ontology/LNC/'),
-#     'OWL': NamespaceInfo('owl', 'http://www.w3.org/2002/07/owl#'),
-#     'SNOMED': NamespaceInfo('sct', 'http://snomed.info/id/')
-# }
-#
-# namespaces['LOINC'].urls.add([AccessInfo(ServiceType.FHIR, 'https://fhir.loinc.org/CodeSystem/$lookup?system=http://loinc.org&code={cid}')])
-#
-# namespaces['SNOMED'].urls.add([AccessInfo(ServiceType.CUSTOM, 'http://snomed.info/id/{cid}'),
-#                                AccessInfo(ServiceType.BIOPORTAL, 'http://purl.bioontology.org/ontology/SNOMEDCT/{cid}'),
-#                                AccessInfo(ServiceType.BIOPORTAL_REST, 'https://data.bioontology.org/ontologies/SNOMEDCT/classes/http%3A%2F%2Fpurl.bioontology.org%2Fontology%2FSNOMEDCT%2F{cid}?apikey={bioportalapikey}')])
\ No newline at end of file
+    uri = code_resolver.resolve(code)
+    if uri is None:
+        raise ValueError(f"Malformed code: {code}")
+    return uri
+
+# Terminology services used to enrich the codes that concepts map to (see enrichment.py).  {cid} is the code and
+# any other template field is supplied by the caller (e.g. bioportalapikey)
+services: Dict[str, NamespaceInfo] = {
+    'RXNORM': NamespaceInfo('rxnorm', namespaces['RXNORM'],
+                            [AccessInfo(ServiceType.CUSTOM,
+                                        'https://rxnav.nlm.nih.gov/REST/rxcui/{cid}/properties.json',
+                                        ['application/json'])]),
+    'LOINC': NamespaceInfo('loinc', namespaces['LOINC'],
+                           [AccessInfo(ServiceType.FHIR,
+                                       'https://fhir.loinc.org/CodeSystem/$lookup?system=http://loinc.org&code={cid}',
+                                       ['application/fhir+json'], credentials_required=True)]),
+    'SNOMED': NamespaceInfo('sct', 'http://snomed.info/id/',
+                            [AccessInfo(ServiceType.FHIR, 'https://snowstorm.ihtsdotools.org/fhir/CodeSystem/$lookup'
+                                                          '?system=http://snomed.info/sct&code={cid}',
+                                        ['application/fhir+json']),
+                             AccessInfo(ServiceType.BIOPORTAL_REST,
+                                        'https://data.bioontology.org/ontologies/SNOMEDCT/classes/'
+                                        'http%3A%2F%2Fpurl.bioontology.org%2Fontology%2FSNOMEDCT%2F{cid}'
+                                        '?apikey={bioportalapikey}', ['application/json'], credentials_required=True)])
+}
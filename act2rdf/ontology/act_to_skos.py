@@ -2,7 +2,9 @@ import argparse
 import logging
 import os
 import sys
-from typing import List, Tuple, Optional, Dict, Any
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Tuple, Optional, Dict, Any, Set, Iterator, Union
 
 from i2b2model.metadata.i2b2ontology import OntologyEntry
 from i2b2model.metadata.i2b2ontologyvisualattributes import VisualAttributes
@@ -12,18 +14,30 @@ from i2b2model.sqlsupport.file_aware_parser import FileAwareParser
 from i2b2model.sqlsupport.i2b2tables import I2B2Tables
 from rdflib import Dataset, RDF, OWL, URIRef, Literal
 from rdflib.namespace import SKOS
-from sqlalchemy import text
-from sqlalchemy.engine import Connection
+from sqlalchemy import text, bindparam, Table, MetaData, create_engine
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import QueuePool
 
 from act2rdf import DATA_DIR
-from namespaces_and_uris import code_to_uri, namespaces
-from ontology.codesystem_membership import is_valid_code
+from coderesolver import local_name
+from compactstore import CompactSink, COMPACT_EXT
+from fingerprint import FingerprintStore, FINGERPRINT_FILE, table_fingerprint, combine
+from metrics import metrics, report_file
+from namespaces_and_uris import code_resolver, namespaces
+from ontology.closure import add_value_set_members
+from ontology.codesystem_membership import validate_codes, code_validator
+from shards import ShardedSink, manifest_file
+from termcache import TermCache
+from triplestore import TripleStore
+
+
+# Interned ACT concept URIs.  Parents are looked up once for every child row
+act_terms = TermCache(namespaces['ACT'], local_name)
 
 
 class ACTMETA(type):
     def __getitem__(self, code: str) -> URIRef:
-        return namespaces['ACT'][code.replace(' ', '_').replace('|', '%7C')]
+        return act_terms.uri(code)
 
 
 class ACT(metaclass=ACTMETA):
@@ -39,11 +53,34 @@ TABLE_PREFIX = 'ACT_'           # Only process tables that start with this prefi
 SKIP_TABLES = ['ACT_DEMO']
 ONE_TABLE = False               # True means process first matching table, False means all matching tables
 NUM_CODES = 0                   # Number of codes to process (debug). 0 means all
+BATCH_SIZE = 5000               # Draggable entries resolved per batch of value set queries.  0 means one query
+                                # per entry
+IN_LIST_SIZE = 500              # Maximum number of dimcodes in a single IN (...) list
+BINDABLE_OPERATORS = ('=', 'LIKE')  # Operators whose dimcode is a single value that can be a bound parameter
+STREAM_CHUNK = 10000            # Number of ontology rows fetched per round trip
+
+# Columns read from the ontology and table_access tables.  Only these are fetched, as plain row tuples
+ONTOLOGY_COLUMNS = ['c_fullname', 'c_name', 'c_basecode', 'c_tooltip', 'c_visualattributes', 'c_facttablecolumn',
+                    'c_tablename', 'c_columnname', 'c_columndatatype', 'c_operator', 'c_dimcode']
+TABLE_ACCESS_COLUMNS = ['c_table_cd', 'c_table_name', 'c_fullname']
 OUTPUT_DIR = DATA_DIR
 DEBUG = False                   # Emit diagnostic statements
+COMPACT_OUTPUT = False          # True means also write a compact binary store (compactstore) next to each .ttl
+RDFLIB_DATASET = False          # True means collect each table in an rdflib Dataset rather than a TripleStore
+SHARD_OUTPUT = False            # True means split each table's .ttl into one file per top concept plus a manifest
+SHARD_SIZE = 0                  # Maximum number of triples per shard file.  0 means no limit
+SHARD_GZIP = False              # True means gzip the shard files
+CONNECTIONS_PER_WORKER = 4      # Database connections each worker may open (a connection and a session per engine)
+
+AnyGraph = Union[Dataset, TripleStore]
+
 
+def new_graph() -> AnyGraph:
+    """ Return an empty graph to collect a table in """
+    return Dataset() if RDFLIB_DATASET else TripleStore()
 
-# Unique key to pre-built query
+
+# Unique key to a prepared statement
 class QueryKey:
     facttablecolumn: str
     tablename: str
@@ -51,33 +88,134 @@ class QueryKey:
     operator: str
     datatype: str
 
-    def __init__(self, te: OntologyEntry) -> None:
+    def __init__(self, te: OntologyEntry, oper: str) -> None:
         self.facttablecolumn = te.c_facttablecolumn
         self.tablename = te.c_tablename.lower()
-        self.columnname = te.c_facttablecolumn
-        self.operator = te.c_operator
+        self.columnname = te.c_columnname
+        self.operator = oper.upper()
+        self.datatype = te.c_columndatatype
+
+    def _key(self) -> Tuple[str, str, str, str, str]:
+        return self.tablename, self.facttablecolumn, self.columnname, self.operator, self.datatype
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, QueryKey) and self._key() == other._key()
 
 
 class QueryTexts:
+    """
+    Value set queries against the CRC.  Statements are built once per (table, column, operator, datatype) with the
+    dimcode as a bound parameter (:dim), or an expanding parameter (:dims) for batched IN queries, so the compiled
+    text() objects are reused and the database sees one statement per template rather than one per concept.
+    """
     tables: I2B2Tables
-    query_tables: Dict[QueryKey, text] = dict()
+    statements: Dict[QueryKey, text]
     ont_session: Session = None
     crc_session: Session = None
 
     def __init__(self, tables: I2B2Tables) -> None:
         self.tables = tables
+        self.statements = dict()
+        self.hits = 0
+        self.misses = 0
+        self.inline = 0
         self.ont_session = sessionmaker(bind=tables.ont_engine)()
         self.crc_session = sessionmaker(bind=tables.crc_engine)()
 
-    def get_query(self, te: OntologyEntry, dim: str, oper: str) -> Tuple[Connection, text]:
-        return self.tables[te.c_tablename.lower()], \
-               self.query_tables.setdefault(QueryKey(te), self._gentext(te).format(dim=dim, oper=oper))
+    def get_query(self, te: OntologyEntry, oper: str) -> text:
+        """
+        Return the prepared statement that selects the rows of te's table where te's column matches :dim using oper
+        :param te: ontology entry
+        :param oper: comparison operator (e.g. '=' or 'LIKE')
+        :return: statement with a :dim bind parameter
+        """
+        key = QueryKey(te, oper)
+        stmt = self.statements.get(key)
+        if stmt is None:
+            self.misses += 1
+            stmt = self.statements[key] = text(self._gentext(te).format(oper=oper, dim=':dim'))
+        else:
+            self.hits += 1
+        return stmt
+
+    def get_in_query(self, te: OntologyEntry) -> text:
+        """ Return the prepared statement that selects the rows of te's table where te's column is IN :dims """
+        key = QueryKey(te, 'IN')
+        stmt = self.statements.get(key)
+        if stmt is None:
+            self.misses += 1
+            stmt = self.statements[key] = text(self._gentext(te).format(oper='IN', dim=':dims'))\
+                .bindparams(bindparam('dims', expanding=True))
+        else:
+            self.hits += 1
+        return stmt
+
+    def inline_query(self, te: OntologyEntry, dim: str, oper: str) -> text:
+        """ Return a one-off statement with dim (an SQL expression, e.g. a list or range) inlined """
+        self.inline += 1
+        return text(self._gentext(te).format(oper=oper, dim=dim))
 
     def _gentext(self, te: OntologyEntry) -> str:
         table = self.tables[te.c_tablename.lower()]
         return f"SELECT {te.c_facttablecolumn}, {te.c_columnname} " \
                f"FROM {table} WHERE {te.c_columnname} {{oper}} {{dim}} ;"
 
+    def stats(self) -> Dict[str, int]:
+        return dict(statements=len(self.statements), hits=self.hits, misses=self.misses, inline=self.inline)
+
+    def close(self) -> None:
+        """ Close the sessions and connections and release the engines' pooled connections """
+        self.ont_session.close()
+        self.crc_session.close()
+        self.tables.crc_connection.close()
+        self.tables.ont_connection.close()
+        self.tables.crc_engine.dispose()
+        self.tables.ont_engine.dispose()
+
+
+class PooledI2B2Tables(I2B2Tables):
+    """
+    I2B2Tables whose engines have a fixed size pool with no overflow, so that the tables and the QueryTexts sessions
+    built on them never hold more than max_connections database connections between them.  Used by the workers, so
+    that --maxconnections is a hard limit.
+    """
+    def __init__(self, opts: argparse.Namespace, max_connections: int = CONNECTIONS_PER_WORKER) -> None:
+        crc_url, ont_url = self._db_urls(opts)
+        # Each engine holds a connection of its own and one for its QueryTexts session
+        pool_size = max_connections if ont_url == crc_url else max_connections // 2
+        metadata = MetaData()
+        self.crc_engine = create_engine(crc_url, poolclass=QueuePool, pool_size=pool_size, max_overflow=0)
+        self.crc_connection = self.crc_engine.connect()
+        metadata.reflect(bind=self.crc_engine, schema=self.i2b2crc)
+        self._crc_tables = metadata.tables
+        if ont_url != crc_url:
+            self.ont_engine = create_engine(ont_url, poolclass=QueuePool, pool_size=pool_size, max_overflow=0)
+            self.ont_connection = self.ont_engine.connect()
+        else:
+            self.ont_engine = self.crc_engine
+            self.ont_connection = self.crc_connection
+        metadata.reflect(bind=self.ont_engine, schema=self.i2b2metadata)
+        self._ont_tables = metadata.tables
+
+
+def stream_rows(session: Session, table: Table, columns: List[str], order_by: Optional[str] = None) -> Iterator:
+    """
+    Return the rows of table, projected on columns, without materializing the table.  Rows are fetched STREAM_CHUNK
+    at a time through a server side cursor where the database supports one.
+    :param session: session to query with
+    :param table: table to read
+    :param columns: columns to return.  Values are accessible by name (row.c_fullname)
+    :param order_by: optional column to order by
+    :return: row iterator
+    """
+    q = session.query(*[table.c[c] for c in columns])
+    if order_by:
+        q = q.order_by(table.c[order_by])
+    return iter(q.yield_per(STREAM_CHUNK))
+
 
 def proc_fullname(base: str, fn: str) -> Tuple[str, ...]:
     """
@@ -89,61 +227,170 @@ def proc_fullname(base: str, fn: str) -> Tuple[str, ...]:
     return tuple(fn.replace(base, '\\\\').split('\\')[-3:-1])
 
 
-def get_te_valueset(queries: QueryTexts, te: OntologyEntry) -> Tuple[str, List[str], List[str]]:
+def get_te_valueset(queries: QueryTexts, te: OntologyEntry, count_entry: bool = True) \
+        -> Tuple[str, List[str], List[str]]:
     """
     Return all members of the value set and the exact match
     :param queries:
     :param te:
+    :param count_entry: count te in the valueset_sql entries metric (False when get_te_valuesets already has)
     :return: column name, value set members, exact match
     """
+    params = dict()
     if te.c_columndatatype == 'T':
-        # Beware of the double escape requirement for percents
         upper_oper = te.c_operator.upper()
-        if (not COMPUTE_MEMBERS or VisualAttributes(te.c_visualattributes).leaf) and upper_oper == 'LIKE' and VisualAttributes(te.c_visualattributes).approximate:
+        if is_prefix_query(te):
             print(f"Approximate leaf {te.c_fullname}")
             oper = te.c_operator
-            dimcode = te.c_dimcode.replace('\\', '\\\\') + "%%"
+            dimcode = te.c_dimcode.replace('\\', '\\\\') + "%"
         else:
             oper = '=' if upper_oper == 'LIKE' else te.c_operator
             dimcode = te.c_dimcode
-        dimcode = f"'{dimcode}'"
+        if oper.upper() in BINDABLE_OPERATORS:
+            querytext, params = queries.get_query(te, oper), dict(dim=dimcode)
+        else:
+            querytext = queries.inline_query(te, f"'{dimcode}'", oper)
     else:
-        oper, dimcode = te.c_operator, te.c_dimcode
-    table, querytext = queries.get_query(te, dimcode, oper)
+        querytext = queries.inline_query(te, te.c_dimcode, te.c_operator)
     if DEBUG:
-        print(querytext)
-    qr = list(queries.crc_session.execute(querytext))
+        print(querytext, params)
+    with metrics.stage('valueset_sql'):
+        qr = list(queries.crc_session.execute(querytext, params))
+    metrics.count('valueset_sql', 'queries')
+    if count_entry:
+        metrics.count('valueset_sql', 'entries')
+    return te.c_columnname, [clean(e) for e in qr], [clean(e) for e in qr if e[1] == te.c_dimcode]
 
-    def clean(e: Any) -> Any:
-        ent = e[0]
-        return ent.strip() if isinstance(ent, str) else ent
 
-    return te.c_columnname, [clean(e) for e in qr], [clean(e) for e in qr if e[1] == te.c_dimcode]
+def is_prefix_query(te: OntologyEntry) -> bool:
+    """ Return True if te is resolved with a LIKE 'dimcode%' query """
+    va = VisualAttributes(te.c_visualattributes)
+    return (not COMPUTE_MEMBERS or va.leaf) and te.c_operator.upper() == 'LIKE' and va.approximate
 
 
-def evaluate_ontology_entry(queries: QueryTexts, te: OntologyEntry, cid: URIRef, g: Dataset) -> None:
+def is_batchable(te: OntologyEntry) -> bool:
+    """ Return True if te is resolved with an equality test on a text column and can be batched """
+    return te.c_columndatatype == 'T' and te.c_operator.upper() in ('LIKE', '=') and not is_prefix_query(te)
+
+
+def clean(e: Any) -> Any:
+    ent = e[0]
+    return ent.strip() if isinstance(ent, str) else ent
+
+
+ValueSetGroup = Tuple[str, str, str]
+
+
+def valueset_group(te: OntologyEntry) -> ValueSetGroup:
+    """ Return the (table, fact table column, column) that te's value set query runs against """
+    return te.c_tablename.lower(), te.c_facttablecolumn, te.c_columnname
+
+
+def loose_key(dimcode: str) -> str:
+    """ Return dimcode as compared by a case insensitive, trailing space padded collation """
+    return dimcode.rstrip().casefold()
+
+
+def get_te_valuesets(queries: QueryTexts, entries: List[OntologyEntry]) \
+        -> Dict[Tuple[ValueSetGroup, str], Tuple[List[str], List[str]]]:
     """
-    Execute the OntologyEntry row in te and get the resulting set fact table keys
+    Resolve the value sets of a batch of (batchable) entries with chunked IN (...) queries, one set of queries per
+    table/column combination.
+
+    Returned rows are assigned to the dimcode their column equals.  A database whose collation is looser than that
+    (case insensitive, or ignoring trailing spaces, as SQL Server's default) can also return rows that only match
+    under the collation, and a single entry's query would include them.  So a chunk is resolved one entry at a time,
+    as get_te_valueset does, if any row doesn't equal one of its dimcodes or two of its dimcodes are equal ignoring
+    case and trailing spaces.
     :param queries: QueryTexts instance
-    :param te: OntologyEntry instance to look up
+    :param entries: entries to resolve
+    :return: map from (valueset_group, dimcode) to the value set members and exact matches
+    """
+    groups: Dict[ValueSetGroup, Dict[str, OntologyEntry]] = dict()
+    for te in entries:
+        groups.setdefault(valueset_group(te), dict()).setdefault(te.c_dimcode, te)
+    rslt: Dict[Tuple[ValueSetGroup, str], Tuple[List[str], List[str]]] = dict()
+    for group, dim_entries in groups.items():
+        querytext = queries.get_in_query(next(iter(dim_entries.values())))
+        dimcodes = sorted(dim_entries)
+        for i in range(0, len(dimcodes), IN_LIST_SIZE):
+            chunk = dimcodes[i:i + IN_LIST_SIZE]
+            with metrics.stage('valueset_sql'):
+                qr = list(queries.crc_session.execute(querytext, dict(dims=chunk)))
+            metrics.count('valueset_sql', 'queries')
+            members: Dict[str, List[str]] = {dimcode: [] for dimcode in chunk}
+            exact = len({loose_key(dimcode) for dimcode in chunk}) == len(chunk)
+            for e in qr:
+                codes = members.get(e[1])
+                if codes is None:
+                    exact = False
+                    break
+                codes.append(clean(e))
+            if exact:
+                for dimcode, codes in members.items():
+                    rslt[(group, dimcode)] = (codes, codes)
+            else:
+                metrics.count('valueset_sql', 'unbatched_chunks')
+                for dimcode in chunk:
+                    _, codes, exacts = get_te_valueset(queries, dim_entries[dimcode], count_entry=False)
+                    rslt[(group, dimcode)] = (codes, exacts)
+    metrics.count('valueset_sql', 'entries', len(entries))
+    return rslt
+
+
+def valid_code_uris(codes: List[str]) -> List[URIRef]:
+    """ Return the URIs of the valid codes in codes """
+    return [uri for uri in code_resolver.resolve_many(c for c, valid in zip(codes, validate_codes(codes)) if valid)
+            if uri is not None]
+
+
+def record_valueset(te: OntologyEntry, cid: URIRef, codes: List[str], exacts: List[str], g: AnyGraph) -> None:
+    """
+    Record the value set of te
+    :param te: OntologyEntry instance
     :param cid: parent concept identifier
+    :param codes: value set members
+    :param exacts: exact matches
     :param g: Graph to add entries to
-    :return:
     """
-    column_name, codes, exacts = get_te_valueset(queries, te)
     if codes:
         if EXPLICIT_MEMBERS:
             g.add((cid, RDF.type, ISO.EnumeratedConceptualDomain))
         if not COMPUTE_MEMBERS and EXPLICIT_MEMBERS:
-            for code in codes:
-                if is_valid_code(code):
-                    g.add((cid, ISO['enumeratedConceptualDomain.hasMember'], code_to_uri(code)))
-        for exact in exacts:
-            if is_valid_code(exact):
-                g.add((cid, SKOS.exactMatch, code_to_uri(exact)))
+            for uri in valid_code_uris(codes):
+                g.add((cid, ISO['enumeratedConceptualDomain.hasMember'], uri))
+        for uri in valid_code_uris(exacts):
+            g.add((cid, SKOS.exactMatch, uri))
 
 
-def proc_ontology_table(queries: QueryTexts, table_name: str, concept_scheme: URIRef, basename: str, g: Dataset) -> int:
+def evaluate_ontology_entry(queries: QueryTexts, te: OntologyEntry, cid: URIRef, g: AnyGraph) -> None:
+    """
+    Execute the OntologyEntry row in te and get the resulting set fact table keys
+    :param queries: QueryTexts instance
+    :param te: OntologyEntry instance to look up
+    :param cid: parent concept identifier
+    :param g: Graph to add entries to
+    :return:
+    """
+    column_name, codes, exacts = get_te_valueset(queries, te)
+    record_valueset(te, cid, codes, exacts, g)
+
+
+def evaluate_ontology_entries(queries: QueryTexts, entries: List[Tuple[OntologyEntry, URIRef]], g: AnyGraph) -> None:
+    """
+    Batched form of evaluate_ontology_entry
+    :param queries: QueryTexts instance
+    :param entries: batchable OntologyEntry instances and their concept identifiers
+    :param g: Graph to add entries to
+    """
+    valuesets = get_te_valuesets(queries, [te for te, _ in entries])
+    for te, cid in entries:
+        codes, exacts = valuesets.get((valueset_group(te), te.c_dimcode), ([], []))
+        record_valueset(te, cid, codes, exacts, g)
+
+
+def proc_ontology_table(queries: QueryTexts, table_name: str, concept_scheme: URIRef, basename: str, g: AnyGraph) \
+        -> int:
     """
     Process the entries in ontology table, table
     :param queries: QueryText instance
@@ -156,8 +403,8 @@ def proc_ontology_table(queries: QueryTexts, table_name: str, concept_scheme: UR
     te: OntologyEntry
     table = queries.tables[table_name.lower()]
     nentries = 0
-    q = queries.ont_session.query(table) if not NUM_CODES else queries.ont_session.query(table).order_by(table.c.c_fullname)
-    for te in q.all():
+    batch: List[Tuple[OntologyEntry, URIRef]] = []
+    for te in stream_rows(queries.ont_session, table, ONTOLOGY_COLUMNS, 'c_fullname' if NUM_CODES else None):
         parent, ccode = proc_fullname(basename, te.c_fullname)
         if ccode:
             cid = ACT[ccode]
@@ -176,14 +423,23 @@ def proc_ontology_table(queries: QueryTexts, table_name: str, concept_scheme: UR
             # Some sort of PyCharm debbugger issue here...
             va = VisualAttributes(te.c_visualattributes)
             if va.draggable:
-                evaluate_ontology_entry(queries, te, cid, g)
+                if BATCH_SIZE and is_batchable(te):
+                    batch.append((te, cid))
+                    if len(batch) >= BATCH_SIZE:
+                        evaluate_ontology_entries(queries, batch, g)
+                        batch = []
+                else:
+                    evaluate_ontology_entry(queries, te, cid, g)
             nentries += 1
             if NUM_CODES and nentries >= NUM_CODES:
                 break
+    if batch:
+        evaluate_ontology_entries(queries, batch, g)
+    metrics.count('convert', 'rows', nentries)
     return nentries
 
 
-def proc_table_access_row(queries: QueryTexts, ta: TableAccess, g: Dataset) -> int:
+def proc_table_access_row(queries: QueryTexts, ta: TableAccess, g: AnyGraph) -> int:
     """
     Process a table_access entry
     :param queries: query cache and tables access
@@ -208,40 +464,183 @@ def parse_args(argv: List[str]) -> Optional[argparse.Namespace]:
     """
     parser = FileAwareParser(description="Iterate over table_access table", prog="table_access")
     add_connection_args(parser)
+    parser.add_argument("--workers", help="Number of tables to convert concurrently", type=int, default=1)
+    parser.add_argument("--incremental", help="Only convert tables whose contents changed since the last run",
+                        action="store_true")
+    parser.add_argument("--compact", help="Also write each table as a compact binary store", action="store_true")
+    parser.add_argument("--dataset", help="Collect each table in an rdflib Dataset instead of the lightweight triple "
+                                          "store", action="store_true")
+    parser.add_argument("--shard", help="Split each table into one turtle file per top concept and list them in "
+                                        "<table>-manifest.json", action="store_true")
+    parser.add_argument("--shard-size", help="Maximum triples per shard file (0: no limit).  Implies --shard",
+                        type=int, default=0)
+    parser.add_argument("--gzip", help="Compress the shard files.  Implies --shard", action="store_true")
+    parser.add_argument("--maxconnections", help="Maximum number of database connections to use across all workers",
+                        type=int, default=20)
+    parser.add_argument("--profile", help="Capture a cProfile of the run", action="store_true")
+    parser.add_argument("--tracemalloc", help="Trace memory allocation and add the top allocators to the run report",
+                        action="store_true")
     opts, _ = parser.parse_known_args(parser.decode_file_args(argv))
     return opts
 
 
-def dump_as_rdf(g: Dataset, table_name: str) -> bool:
+def dump_as_rdf(g: AnyGraph, table_name: str) -> bool:
     """
     Dump the contents of Graph g in RDF turtle
-    :param g: Dataset to dump
+    :param g: graph to dump
     :param table_name: name of the base table
     :return: success indicator
     """
     # Propagate the mapped concepts up the tree
-    def add_to_ancestors(s: URIRef, vm: URIRef):
-        g.add((s, ISO['enumeratedConceptualDomain.hasMember'], vm))
-        for parent in g.objects(s, SKOS.broader):
-            add_to_ancestors(parent, vm)
-
     if COMPUTE_MEMBERS and EXPLICIT_MEMBERS:
-        for subj, obj in g.subject_objects(SKOS.exactMatch):
-            add_to_ancestors(subj, obj)
-        # TODO: this gives us a list of all concepts in the scheme... useful?
-        for scheme, tc in g.subject_objects(SKOS.hasTopConcept):
-            for member in g.objects(tc, ISO['enumeratedConceptualDomain.hasMember']):
-                g.add((scheme, ISO['enumeratedConceptualDomain.hasMember'], member))
+        with metrics.stage('closure'):
+            metrics.count('closure', 'triples', add_value_set_members(g))
 
     for name, ns in namespaces.items():
         g.bind(name.lower(), ns)
-    outfile = os.path.join(DATA_DIR, table_name + '.ttl')
+    outfile = output_files(table_name)[0]
     print(f"Saving output to {outfile}")
-    g.serialize(outfile, format='turtle')
+    with metrics.stage('serialize'):
+        if SHARD_OUTPUT:
+            dump_shards(g, table_name)
+        else:
+            g.serialize(outfile, format='turtle')
+        if COMPACT_OUTPUT:
+            with CompactSink(os.path.join(DATA_DIR, table_name + COMPACT_EXT)) as sink:
+                for name, ns in g.namespaces():
+                    sink.bind(name, ns)
+                for t in g:
+                    sink.add(t)
+    metrics.count('serialize', 'triples', len(g))
     print(f"{len(g)} triples written")
+    if DEBUG:
+        print(f"ACT term cache: {act_terms.stats()}")
     return True
 
 
+def dump_shards(g: AnyGraph, table_name: str) -> None:
+    """
+    Write the contents of g as one set of turtle files per top concept, listed in a manifest
+    :param g: graph to dump
+    :param table_name: name of the base table
+    """
+    with ShardedSink(os.path.join(DATA_DIR, table_name), 'ttl', SHARD_SIZE, SHARD_GZIP, dedup=False) as sink:
+        for name, ns in g.namespaces():
+            sink.bind(name, ns)
+        # The rows don't arrive parent first, so the hierarchy is assigned to the shards before anything is written
+        sink.assign_hierarchy(g)
+        for t in g.ordered() if isinstance(g, TripleStore) else sorted(g):
+            sink.add(t)
+    metrics.count('serialize', 'shards', len(sink.shards))
+
+
+def output_file(table_name: str) -> str:
+    return os.path.join(DATA_DIR, table_name + '.ttl')
+
+
+def output_files(table_name: str) -> List[str]:
+    """ Return all of the files written for table_name -- the manifest stands for the files of a sharded table """
+    main_file = manifest_file(os.path.join(DATA_DIR, table_name)) if SHARD_OUTPUT else output_file(table_name)
+    return [main_file] + ([os.path.join(DATA_DIR, table_name + COMPACT_EXT)] if COMPACT_OUTPUT else [])
+
+
+# Fingerprints of the CRC tables read by the value set queries, by (table, columns).  Every ontology table reads the
+# same few CRC tables, so each is only scanned once per run (per worker process)
+crc_fingerprints: Dict[Tuple[str, Tuple[str, ...]], str] = dict()
+
+
+def ontology_fingerprint(queries: QueryTexts, table_name: str) -> str:
+    """
+    Return the fingerprint of an ontology table and of the CRC columns its value set queries read, so that a CRC
+    reload also counts as a change
+    :param queries: query cache and tables access
+    :param table_name: ontology table
+    :return: fingerprint
+    """
+    table = queries.tables[table_name.lower()]
+    fingerprints = [table_fingerprint(queries.ont_session, table, ONTOLOGY_COLUMNS)]
+    crc_columns: Dict[str, Set[str]] = dict()
+    for tablename, facttablecolumn, columnname in \
+            queries.ont_session.query(table.c.c_tablename, table.c.c_facttablecolumn, table.c.c_columnname).distinct():
+        if tablename:
+            columns = crc_columns.setdefault(tablename.lower(), set())
+            columns.update(c.lower() for c in (facttablecolumn, columnname) if c)
+    for tablename, columns in sorted(crc_columns.items()):
+        crc_table = queries.tables[tablename]
+        if crc_table is None:
+            continue
+        names = {c.name.lower(): c.name for c in crc_table.c}
+        key = (tablename, tuple(sorted(names[c] for c in columns if c in names)))
+        if key not in crc_fingerprints:
+            crc_fingerprints[key] = table_fingerprint(queries.crc_session, crc_table, list(key[1]))
+        fingerprints.append(f"{tablename}:{crc_fingerprints[key]}")
+    return combine(fingerprints)
+
+
+def convert_table_access_row(queries: QueryTexts, e: TableAccess, fingerprints: Optional[FingerprintStore] = None) \
+        -> int:
+    """
+    Convert the ontology table behind table_access entry e and write it out
+    :param queries: query cache and tables access
+    :param e: table_access entry
+    :param fingerprints: if present, skip the table if it hasn't changed since its output was written
+    :return: number of elements processed
+    """
+    if fingerprints is not None:
+        fp = ontology_fingerprint(queries, e.c_table_name)
+        if fingerprints.unchanged(e.c_table_cd, fp, output_files(e.c_table_cd)):
+            print(" unchanged", end='')
+            return 0
+    with metrics.unit('table', e.c_table_cd):
+        g = new_graph()
+        with metrics.stage('convert'):
+            nelements = proc_table_access_row(queries, e, g)
+        if nelements:
+            dump_as_rdf(g, e.c_table_cd)
+            print(code_validator.report())
+            if DEBUG:
+                print(f"Value set statements: {queries.stats()}")
+            if code_resolver.counts:
+                print(code_resolver.report())
+            if fingerprints is not None:
+                fingerprints.record(e.c_table_cd, fp, output_files(e.c_table_cd))
+        code_validator.reset()
+        code_resolver.reset()
+    return nelements
+
+
+def convert_table(opts: argparse.Namespace, table_cd: str) \
+        -> Tuple[str, int, float, Optional[str], Dict[str, Any]]:
+    """
+    Worker: convert a single table_access entry using its own engines and sessions
+    :param opts: processed connection arguments
+    :param table_cd: c_table_cd of the entry to convert
+    :return: table_cd, number of elements processed, elapsed seconds, (incremental) new fingerprint and the worker's
+    run metrics
+    """
+    global COMPACT_OUTPUT, RDFLIB_DATASET, SHARD_OUTPUT, SHARD_SIZE, SHARD_GZIP
+    start = time.time()
+    metrics.reset()
+    COMPACT_OUTPUT = opts.compact
+    RDFLIB_DATASET = opts.dataset
+    SHARD_OUTPUT, SHARD_SIZE, SHARD_GZIP = opts.shard, opts.shard_size, opts.gzip
+    process_parsed_args(opts, None, connect=False)
+    queries = QueryTexts(PooledI2B2Tables(opts, CONNECTIONS_PER_WORKER))
+    table_access = queries.tables.table_access
+    e = queries.ont_session.query(*[table_access.c[c] for c in TABLE_ACCESS_COLUMNS])\
+        .filter(table_access.c.c_table_cd == table_cd).one()
+    # The store is only read here.  The parent records the new fingerprint
+    fingerprints = FingerprintStore(fingerprint_file()) if opts.incremental else None
+    nelements = convert_table_access_row(queries, e, fingerprints)
+    queries.close()
+    return table_cd, nelements, time.time() - start, fingerprints.get(table_cd) if fingerprints else None, \
+        metrics.report()
+
+
+def fingerprint_file() -> str:
+    return os.path.join(DATA_DIR, FINGERPRINT_FILE)
+
+
 def proc_table_access_table(opts: argparse.Namespace) -> int:
     """
     Iterate over the table_access table emitting its entries
@@ -250,26 +649,69 @@ def proc_table_access_table(opts: argparse.Namespace) -> int:
     """
     logging.info("Iterating over table_access table")
     process_parsed_args(opts, FileAwareParser.error)
-    queries = QueryTexts(I2B2Tables(opts))
-    q = queries.ont_session.query(queries.tables.table_access)
+    queries = QueryTexts(getattr(opts, 'tables', None) or I2B2Tables(opts))
+    table_access = queries.tables.table_access
     e: TableAccess
-    for e in q.all():
+    entries = queries.ont_session.query(*[table_access.c[c] for c in TABLE_ACCESS_COLUMNS]).all()
+    workers = max(1, min(getattr(opts, 'workers', 1), getattr(opts, 'maxconnections', 0) // CONNECTIONS_PER_WORKER))
+    if workers > 1:
+        # The workers get the whole connection budget -- nothing is held here while they run
+        queries.close()
+        return proc_table_access_parallel(opts, entries, workers)
+    fingerprints = FingerprintStore(fingerprint_file()) if getattr(opts, 'incremental', False) else None
+    for e in entries:
         print(f"{e.c_table_cd}", end='')
         if not e.c_table_cd.startswith(TABLE_PREFIX) or e.c_table_cd in SKIP_TABLES:
             print(" skipped")
             continue
-        g = Dataset()
-        nelements = proc_table_access_row(queries, e, g)
+        nelements = convert_table_access_row(queries, e, fingerprints)
+        if fingerprints is not None:
+            fingerprints.save()
         if nelements:
             print(f" {nelements} elements processed")
-            dump_as_rdf(g, e.c_table_cd)
             if ONE_TABLE:
                 break
+        else:
+            print()
     else:
         nelements = 0
     return nelements
 
 
+def proc_table_access_parallel(opts: argparse.Namespace, entries: List[TableAccess], workers: int) -> int:
+    """
+    Convert the table_access entries concurrently, one table per worker process
+    :param opts: processed connection arguments
+    :param entries: table_access entries
+    :param workers: number of worker processes
+    :return: total number of elements processed
+    """
+    table_cds = [e.c_table_cd for e in entries
+                 if e.c_table_cd.startswith(TABLE_PREFIX) and e.c_table_cd not in SKIP_TABLES]
+    if ONE_TABLE:
+        table_cds = table_cds[:1]
+    # Engines and connections can't be shipped to the workers -- each one opens its own
+    worker_opts = argparse.Namespace(**{k: v for k, v in vars(opts).items() if k != 'tables'})
+    print(f"Converting {len(table_cds)} tables with {workers} workers")
+    worker_opts.incremental = getattr(opts, 'incremental', False)
+    worker_opts.compact = COMPACT_OUTPUT
+    worker_opts.dataset = RDFLIB_DATASET
+    worker_opts.shard, worker_opts.shard_size, worker_opts.gzip = SHARD_OUTPUT, SHARD_SIZE, SHARD_GZIP
+    fingerprints = FingerprintStore(fingerprint_file()) if worker_opts.incremental else None
+    total = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(convert_table, worker_opts, table_cd) for table_cd in table_cds]
+        for ndone, future in enumerate(as_completed(futures), start=1):
+            table_cd, nelements, elapsed, fp, report = future.result()
+            metrics.merge(report)
+            total += nelements
+            print(f"[{ndone}/{len(futures)}] {table_cd} {nelements} elements processed in {elapsed:.1f}s")
+            if fingerprints is not None and nelements:
+                fingerprints.record(table_cd, fp, output_files(table_cd))
+                fingerprints.save()
+    return total
+
+
 def list_table_access(argv: List[str]) -> bool:
     """
     Iterate over the i2b2 table_access table converting the ACT ontology to SKOS
@@ -281,8 +723,18 @@ def list_table_access(argv: List[str]) -> bool:
     if opts is None:
         return False
 
+    global COMPACT_OUTPUT, RDFLIB_DATASET, SHARD_OUTPUT, SHARD_SIZE, SHARD_GZIP
+    COMPACT_OUTPUT = COMPACT_OUTPUT or opts.compact
+    RDFLIB_DATASET = RDFLIB_DATASET or opts.dataset
+    SHARD_SIZE = SHARD_SIZE or opts.shard_size
+    SHARD_GZIP = SHARD_GZIP or opts.gzip
+    SHARD_OUTPUT = SHARD_OUTPUT or opts.shard or SHARD_SIZE > 0 or SHARD_GZIP
+
     # Convert the tables to RDF
+    metrics.start_capture(getattr(opts, 'profile', False), getattr(opts, 'tracemalloc', False))
     proc_table_access_table(opts)
+    metrics.stop_capture(os.path.join(DATA_DIR, 'act_to_skos.prof'))
+    metrics.write(report_file(os.path.join(DATA_DIR, 'act_to_skos')))
 
 
 if __name__ == "__main__":
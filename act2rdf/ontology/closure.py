@@ -0,0 +1,151 @@
+from array import array
+from typing import Dict, List, Iterator, Set, Tuple
+
+from rdflib import URIRef, Graph
+from rdflib.namespace import SKOS
+
+from namespaces_and_uris import namespaces
+
+HAS_MEMBER = namespaces['iso-11179']['enumeratedConceptualDomain.hasMember']
+EMPTY = array('I')
+
+
+def union(sets: List[array]) -> array:
+    """ Return the sorted union of sorted code id arrays.  A single set is returned as is, not copied """
+    if not sets:
+        return EMPTY
+    if len(sets) == 1:
+        return sets[0]
+    return array('I', sorted(set().union(*sets)))
+
+
+class MemberClosure:
+    """
+    Value set membership closure over the skos:broader tree.  Concepts and codes are mapped to integers, the tree is
+    held as an array of parent indices and the code set of each concept is a sorted array of code ids, so a set costs
+    four bytes per member.  Member sets are computed bottom-up in a single topological pass: each concept is visited
+    once, after all of its children, and its set is the union of its own codes and its children's sets.  A concept
+    with a single contributing set (a chain of single children) shares that array rather than copying it.
+    """
+    def __init__(self) -> None:
+        self.concept_ids: Dict[URIRef, int] = dict()
+        self.concepts: List[URIRef] = []
+        self.parents: List[List[int]] = []
+        self.exact_matches: Dict[int, Set[int]] = dict()
+        self.members: List[array] = []
+        self.code_ids: Dict[URIRef, int] = dict()
+        self.codes: List[URIRef] = []
+
+    def _concept(self, c: URIRef) -> int:
+        cid = self.concept_ids.get(c)
+        if cid is None:
+            cid = self.concept_ids[c] = len(self.concepts)
+            self.concepts.append(c)
+            self.parents.append([])
+            self.members.append(EMPTY)
+        return cid
+
+    def _code(self, c: URIRef) -> int:
+        cid = self.code_ids.get(c)
+        if cid is None:
+            cid = self.code_ids[c] = len(self.codes)
+            self.codes.append(c)
+        return cid
+
+    def add_broader(self, child: URIRef, parent: URIRef) -> None:
+        self.parents[self._concept(child)].append(self._concept(parent))
+
+    def add_exact_match(self, concept: URIRef, code: URIRef) -> None:
+        self.exact_matches.setdefault(self._concept(concept), set()).add(self._code(code))
+
+    @classmethod
+    def from_graph(cls, g: Graph) -> "MemberClosure":
+        closure = cls()
+        for child, parent in g.subject_objects(SKOS.broader):
+            closure.add_broader(child, parent)
+        for concept, code in g.subject_objects(SKOS.exactMatch):
+            closure.add_exact_match(concept, code)
+        return closure
+
+    def compute(self) -> None:
+        """ Propagate the member sets of every concept to all of its ancestors """
+        nconcepts = len(self.concepts)
+        pending = [0] * nconcepts           # Number of children not yet visited
+        for ps in self.parents:
+            for p in ps:
+                pending[p] += 1
+        parts: Dict[int, List[array]] = dict()       # Sets of the visited children of each concept
+
+        def own_and_children(i: int) -> List[array]:
+            sets = parts.pop(i, [])
+            own = self.exact_matches.get(i)
+            if own:
+                sets.append(array('I', sorted(own)))
+            return sets
+
+        ready = [i for i in range(nconcepts) if not pending[i]]
+        nvisited = 0
+        while ready:
+            i = ready.pop()
+            nvisited += 1
+            m = self.members[i] = union(own_and_children(i))
+            for p in self.parents[i]:
+                if m:
+                    parts.setdefault(p, []).append(m)
+                pending[p] -= 1
+                if not pending[p]:
+                    ready.append(p)
+        if nvisited < nconcepts:
+            # Cycles in the broader graph -- push each remaining set up to all of its ancestors
+            remaining = [i for i in range(nconcepts) if pending[i]]
+            partial = {i: set().union(*own_and_children(i)) for i in remaining}
+            full = {i: set(m) for i, m in partial.items()}
+            for i in remaining:
+                seen = {i}
+                todo = list(self.parents[i])
+                while todo:
+                    p = todo.pop()
+                    if p not in seen:
+                        seen.add(p)
+                        full[p] |= partial[i]
+                        todo.extend(self.parents[p])
+            for i, m in full.items():
+                self.members[i] = array('I', sorted(m))
+
+    def members_of(self, concept: URIRef) -> List[URIRef]:
+        cid = self.concept_ids.get(concept)
+        return [self.codes[b] for b in self.members[cid]] if cid is not None else []
+
+    def member_pairs(self) -> Iterator[Tuple[URIRef, URIRef]]:
+        """ Return every (concept, member code) pair """
+        codes = self.codes
+        for cid, m in enumerate(self.members):
+            concept = self.concepts[cid]
+            for b in m:
+                yield concept, codes[b]
+
+
+def add_value_set_members(g: Graph) -> int:
+    """
+    Add the enumeratedConceptualDomain.hasMember closure of the skos:exactMatch codes to g.  Every concept gets the
+    codes of all of its descendants and every concept scheme gets the codes of its top concepts.
+    :param g: graph containing the skos:broader, skos:exactMatch and skos:hasTopConcept assertions
+    :return: number of hasMember assertions
+    """
+    closure = MemberClosure.from_graph(g)
+    closure.compute()
+    nmembers = 0
+    for concept, code in closure.member_pairs():
+        g.add((concept, HAS_MEMBER, code))
+        nmembers += 1
+    # TODO: this gives us a list of all concepts in the scheme... useful?
+    scheme_members: Dict[URIRef, List[array]] = dict()
+    for scheme, tc in g.subject_objects(SKOS.hasTopConcept):
+        cid = closure.concept_ids.get(tc)
+        if cid is not None:
+            scheme_members.setdefault(scheme, []).append(closure.members[cid])
+    for scheme, sets in scheme_members.items():
+        for b in union(sets):
+            g.add((scheme, HAS_MEMBER, closure.codes[b]))
+            nmembers += 1
+    return nmembers
@@ -1,10 +1,11 @@
 import re
+from typing import Dict, List, Iterable, Tuple, Optional
 
-# Valid code pattern by namespace
-from typing import Dict
+from codecheck import CodeChecker, CACHE_SIZE
 
 DEBUG = False
 
+# Valid code pattern by namespace
 code_re: Dict[str, re.Pattern] = {'CPT4': re.compile(r'[0-9]+[A-Z]?$'),
                                   'HCPCS': re.compile(r'[A-Z0-9]+$'),
                                   'ICD10CM': re.compile(r'[A-Z][0-9][0-9A-Z](\.[0-9A-Z]+)?$'),
@@ -16,17 +17,56 @@ code_re: Dict[str, re.Pattern] = {'CPT4': re.compile(r'[0-9]+[A-Z]?$'),
                                   'RXNORM': re.compile(r'[0-9]+$'),
                                   'UMLS': re.compile(r'C[0-9]+$')}
 
+# Validation outcomes
+VALID = 'valid'
+INVALID = 'invalid'
+UNKNOWN_NS = 'unknown namespace'
+MALFORMED = 'malformed'
+
+
+class CodeValidator(CodeChecker):
+    """
+    Validates namespace:code strings.  Each namespace dispatches straight to its precompiled pattern, and failures are
+    tallied by outcome and namespace (see CodeChecker).
+    """
+    failure_title = "Code validation failures"
+    success_message = "All codes valid"
+
+    def __init__(self, patterns: Dict[str, re.Pattern] = None, cache_size: int = CACHE_SIZE) -> None:
+        super().__init__(cache_size)
+        self.matchers = {ns: p.match for ns, p in (patterns or code_re).items()}
+
+    def _classify(self, code: str) -> Tuple[str, Optional[str]]:
+        """ Return the outcome of validating code and its namespace """
+        ns, sep, name = code.partition(':')
+        if not sep:
+            return MALFORMED, None
+        matcher = self.matchers.get(ns)
+        if matcher is None:
+            return UNKNOWN_NS, ns
+        return (VALID if matcher(name) else INVALID), ns
+
+    def is_valid(self, code: str) -> bool:
+        outcome, ns = self.classify(code)
+        if outcome is VALID:
+            return True
+        self.tally(outcome, ns, code)
+        if DEBUG:
+            print(f"{outcome}: {code}")
+        return False
+
+    def validate(self, codes: Iterable[str]) -> List[bool]:
+        """ Validate a batch of codes """
+        is_valid = self.is_valid
+        return [is_valid(code) for code in codes]
+
+
+code_validator = CodeValidator()
+
 
 def is_valid_code(code: str) -> bool:
-    if ':' in code:
-        ns, name = code.split(':', 1)
-        if ns in code_re:
-            if not code_re[ns].match(name) and (DEBUG or '-' not in code):
-                print(f"Code is not valid: {code}")
-            return bool(code_re[ns].match(name))
-        else:
-            print(f"Unrecognized namespace: {ns} in {code}")
-            return False
-    else:
-        print(f"Invalid code: {code}")
-        return False
\ No newline at end of file
+    return code_validator.is_valid(code)
+
+
+def validate_codes(codes: Iterable[str]) -> List[bool]:
+    return code_validator.validate(codes)
@@ -0,0 +1,387 @@
+import argparse
+import asyncio
+import base64
+import http.client
+import json
+import sqlite3
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from queue import Queue, Empty
+from string import Formatter
+from typing import Dict, List, Optional, Tuple, Iterable, Callable, Any
+from urllib.parse import urlsplit, quote
+
+from rdflib import URIRef, Literal, OWL
+from rdflib.namespace import SKOS
+
+from act2rdf.accessinfo import AccessInfo, NamespaceInfo, ServiceType
+from metrics import metrics
+from namespaces_and_uris import services
+from ontology.to_jsonld import source_triples
+from triplesink import open_sink
+
+DEFAULT_TTL = 30 * 24 * 3600    # Seconds a cached response stays valid
+DEFAULT_CONCURRENCY = 8         # Concurrent requests (and pooled connections) per service host
+DEFAULT_TIMEOUT = 30            # Socket timeout in seconds
+COMMIT_EVERY = 1000             # Cached responses written per transaction
+CACHEABLE_STATUSES = (200, 404)  # Responses that are cached.  Errors (401, 403, 429, 5xx) are asked for again next run
+RETRY_STATUSES = (429, 503)     # Responses that are retried after a back off
+MAX_RETRIES = 4                 # Retries per request
+BACKOFF = 1.0                   # Seconds before the first retry (unless the server sends Retry-After), doubled after
+MAX_BACKOFF = 60.0              # Longest wait before a retry
+
+# Lookup outcomes
+ACTIVE = 'active'
+INACTIVE = 'inactive'
+NOT_FOUND = 'not_found'
+ERROR = 'error'
+
+
+@dataclass
+class Lookup:
+    status: str
+    label: Optional[str] = None
+
+
+class ResponseCache:
+    """ Persistent (SQLite) cache of service responses keyed by request url, with a time to live """
+    def __init__(self, path: str, ttl: float = DEFAULT_TTL) -> None:
+        self.ttl = ttl
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses "
+                          "(url TEXT PRIMARY KEY, status INTEGER, body TEXT, fetched REAL)")
+        self.pending = 0
+
+    def get(self, url: str) -> Optional[Tuple[int, str]]:
+        row = self.conn.execute("SELECT status, body, fetched FROM responses WHERE url = ?", (url,)).fetchone()
+        # Error responses cached by earlier versions are ignored
+        if row is None or row[0] not in CACHEABLE_STATUSES or time.time() - row[2] > self.ttl:
+            return None
+        return row[0], row[1]
+
+    def put(self, url: str, status: int, body: str) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (url, status, body, time.time()))
+        self.pending += 1
+        if self.pending >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self) -> None:
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self) -> None:
+        self.commit()
+        self.conn.close()
+
+
+class ConnectionPool:
+    """ Keep-alive HTTP(S) connections to a single host """
+    def __init__(self, scheme: str, netloc: str, size: int, timeout: float = DEFAULT_TIMEOUT) -> None:
+        self.factory = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        self.netloc = netloc
+        self.timeout = timeout
+        self.idle: Queue = Queue(size)
+
+    def _connection(self) -> http.client.HTTPConnection:
+        try:
+            return self.idle.get_nowait()
+        except Empty:
+            return self.factory(self.netloc, timeout=self.timeout)
+
+    def get(self, path: str, headers: Dict[str, str]) -> Tuple[int, str, Optional[str]]:
+        """
+        Issue a GET, retrying once on a fresh connection if a pooled one has gone stale
+        :return: status, body and Retry-After header
+        """
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read().decode('utf-8', errors='replace')
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                if attempt:
+                    raise
+                continue
+            if resp.will_close:
+                conn.close()
+            else:
+                self.idle.put_nowait(conn)
+            return resp.status, body, resp.getheader('Retry-After')
+
+    def close(self) -> None:
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+
+
+def parse_fhir(body: Dict[str, Any]) -> Lookup:
+    """ FHIR CodeSystem/$lookup Parameters resource """
+    label, inactive = None, False
+    for param in body.get('parameter', []):
+        if param.get('name') == 'display':
+            label = param.get('valueString')
+        elif param.get('name') == 'property':
+            parts = {p.get('name'): p for p in param.get('part', [])}
+            if parts.get('code', {}).get('valueCode') == 'inactive':
+                inactive = parts.get('value', {}).get('valueBoolean', False)
+    return Lookup(INACTIVE if inactive else ACTIVE, label)
+
+
+def parse_bioportal(body: Dict[str, Any]) -> Lookup:
+    """ BioPortal REST class """
+    return Lookup(INACTIVE if body.get('obsolete') else ACTIVE, body.get('prefLabel'))
+
+
+def parse_custom(body: Dict[str, Any]) -> Lookup:
+    """ RxNav style {"properties": {"name": ...}} or a flat object with a name or label """
+    props = body.get('properties') or body
+    if not props:
+        return Lookup(NOT_FOUND)
+    return Lookup(ACTIVE, props.get('name') or props.get('label') or props.get('prefLabel'))
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str]) -> float:
+    """ Return the seconds to wait before retrying: the server's Retry-After (in seconds) or an exponential back off """
+    if retry_after and retry_after.strip().isdigit():
+        return min(float(retry_after), MAX_BACKOFF)
+    return min(BACKOFF * 2 ** attempt, MAX_BACKOFF)
+
+
+parsers: Dict[ServiceType, Callable[[Dict[str, Any]], Lookup]] = {
+    ServiceType.FHIR: parse_fhir,
+    ServiceType.BIOPORTAL: parse_bioportal,
+    ServiceType.BIOPORTAL_REST: parse_bioportal,
+    ServiceType.CUSTOM: parse_custom
+}
+
+
+class Enricher:
+    """
+    Resolve codes against the terminology services in ``services``.  Requests run on a thread pool driven from an
+    asyncio loop, with a concurrency limit and a pool of keep-alive connections per service host.  Identical requests
+    are made once, whether they are in flight or already in the response cache.
+    :param services: namespace (e.g. 'RXNORM') to service description
+    :param cache: response cache
+    :param concurrency: concurrent requests per host
+    :param params: values for url template fields other than {cid} (e.g. bioportalapikey)
+    :param auth: namespace to (user, password) for services that require basic authentication
+    """
+    def __init__(self, services: Dict[str, NamespaceInfo], cache: ResponseCache,
+                 concurrency: int = DEFAULT_CONCURRENCY, params: Optional[Dict[str, str]] = None,
+                 auth: Optional[Dict[str, Tuple[str, str]]] = None, timeout: float = DEFAULT_TIMEOUT) -> None:
+        self.cache = cache
+        self.concurrency = concurrency
+        self.params = params or dict()
+        self.auth = auth or dict()
+        self.timeout = timeout
+        self.access: Dict[str, AccessInfo] = dict()
+        self.namespaces: List[Tuple[str, str]] = []         # (official uri, namespace), longest first
+        for ns, info in services.items():
+            access = next((a for a in info.urls if self._usable(ns, a)), None)
+            if access:
+                self.access[ns] = access
+                self.namespaces.append((str(info.officialuri), ns))
+        self.namespaces.sort(key=lambda e: len(e[0]), reverse=True)
+        self.pools: Dict[str, ConnectionPool] = dict()
+        self.semaphores: Dict[str, asyncio.Semaphore] = dict()
+        self.inflight: Dict[str, asyncio.Future] = dict()
+        self.stats: Counter = Counter()
+
+    def _usable(self, ns: str, access: AccessInfo) -> bool:
+        fields = {f for _, f, _, _ in Formatter().parse(access.url_template) if f and f != 'cid'}
+        if not fields <= self.params.keys():
+            return False
+        return not access.credentials_required or bool(fields) or ns in self.auth
+
+    def split(self, uri: URIRef) -> Optional[Tuple[str, str]]:
+        """ Return the (namespace, code) of uri if it belongs to a service we can use """
+        for base, ns in self.namespaces:
+            if uri.startswith(base):
+                return ns, uri[len(base):]
+        return None
+
+    def request(self, ns: str, code: str) -> Tuple[str, Dict[str, str]]:
+        """ Return the url and headers for looking up code """
+        access = self.access[ns]
+        url = access.url_template.format(cid=quote(code, safe=''), **self.params)
+        headers = {'Accept': ', '.join(access.accept_header or ['application/json'])}
+        if ns in self.auth:
+            headers['Authorization'] = 'Basic ' + base64.b64encode(':'.join(self.auth[ns]).encode()).decode()
+        return url, headers
+
+    def _pool(self, url: str) -> Tuple[ConnectionPool, str]:
+        parts = urlsplit(url)
+        key = f"{parts.scheme}://{parts.netloc}"
+        if key not in self.pools:
+            self.pools[key] = ConnectionPool(parts.scheme, parts.netloc, self.concurrency, self.timeout)
+            self.semaphores[key] = asyncio.Semaphore(self.concurrency)
+        return self.pools[key], key
+
+    async def fetch(self, url: str, headers: Dict[str, str], executor: ThreadPoolExecutor) -> Tuple[int, str]:
+        cached = self.cache.get(url)
+        if cached is not None:
+            self.stats['cached'] += 1
+            return cached
+        if url in self.inflight:
+            self.stats['deduplicated'] += 1
+            return await self.inflight[url]
+        future = self.inflight[url] = asyncio.get_running_loop().create_future()
+        pool, key = self._pool(url)
+        parts = urlsplit(url)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        try:
+            for attempt in range(MAX_RETRIES + 1):
+                async with self.semaphores[key]:
+                    status, body, retry_after = \
+                        await asyncio.get_running_loop().run_in_executor(executor, pool.get, path, headers)
+                self.stats['requests'] += 1
+                if status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                    break
+                self.stats['retried'] += 1
+                await asyncio.sleep(backoff_delay(attempt, retry_after))
+            rslt = (status, body)
+            if status in CACHEABLE_STATUSES:
+                self.cache.put(url, *rslt)
+        except (OSError, http.client.HTTPException) as e:
+            self.stats['failed'] += 1
+            rslt = (0, str(e))
+        future.set_result(rslt)
+        del self.inflight[url]
+        return rslt
+
+    async def lookup(self, ns: str, code: str, executor: ThreadPoolExecutor) -> Lookup:
+        url, headers = self.request(ns, code)
+        status, body = await self.fetch(url, headers, executor)
+        if status == 404:
+            return Lookup(NOT_FOUND)
+        if status != 200:
+            return Lookup(ERROR, body[:200])
+        try:
+            return parsers[self.access[ns].servicetype](json.loads(body))
+        except (ValueError, AttributeError):
+            return Lookup(ERROR, body[:200])
+
+    async def lookup_all(self, codes: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], Lookup]:
+        codes = list(dict.fromkeys(codes))
+        with ThreadPoolExecutor(max_workers=self.concurrency * max(1, len(self.access))) as executor:
+            rslts = await asyncio.gather(*[self.lookup(ns, code, executor) for ns, code in codes])
+        return dict(zip(codes, rslts))
+
+    def resolve(self, codes: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], Lookup]:
+        """
+        Look up a collection of codes
+        :param codes: (namespace, code) pairs.  Namespaces without a usable service must be filtered out first
+        :return: map from (namespace, code) to lookup result
+        """
+        try:
+            return asyncio.run(self.lookup_all(codes))
+        finally:
+            self.cache.commit()
+            for pool in self.pools.values():
+                pool.close()
+            self.pools.clear()
+            self.semaphores.clear()
+
+
+def exact_match_targets(triples: Iterable[Tuple]) -> List[URIRef]:
+    """ Return the distinct skos:exactMatch targets in triples, in order of appearance """
+    return list(dict.fromkeys(o for _, p, o in triples if p == SKOS.exactMatch and isinstance(o, URIRef)))
+
+
+def enrich(targets: Iterable[URIRef], enricher: Enricher, g) -> Counter:
+    """
+    Look up each target and add what was found to g: a skos:prefLabel for every code found and owl:deprecated for
+    inactive codes
+    :param targets: code URIs
+    :param enricher: service access
+    :param g: graph or sink to add the enrichment triples to
+    :return: number of codes per lookup outcome
+    """
+    codes = {}
+    for uri in targets:
+        key = enricher.split(uri)
+        if key:
+            codes[key] = uri
+    with metrics.stage('enrich'):
+        results = enricher.resolve(codes.keys())
+    outcomes: Counter = Counter()
+    for key, rslt in results.items():
+        outcomes[rslt.status] += 1
+        uri = codes[key]
+        if rslt.status in (ACTIVE, INACTIVE) and rslt.label:
+            g.add((uri, SKOS.prefLabel, Literal(rslt.label)))
+        if rslt.status == INACTIVE:
+            g.add((uri, OWL.deprecated, Literal(True)))
+    metrics.count('enrich', 'codes', len(results))
+    metrics.count('enrich', 'requests', enricher.stats['requests'])
+    return outcomes
+
+
+def parse_pairs(entries: List[str], sep: str) -> Dict[str, str]:
+    """ Parse 'name<sep>value' entries """
+    return dict(e.split(sep, 1) for e in entries)
+
+
+def service_overrides(overrides: Dict[str, str]) -> Dict[str, NamespaceInfo]:
+    """
+    Return services with the url template of some namespaces replaced, e.g. to use a mirror or a test server
+    :param overrides: namespace to url template.  The namespace's first service type (and so response format) is kept
+    :return: namespace to service description
+    """
+    rslt = dict(services)
+    for ns, template in overrides.items():
+        info = services[ns]
+        rslt[ns] = replace(info, urls=[replace(info.urls[0], url_template=template)])
+    return rslt
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description="Add terminology service labels and status to the codes that "
+                                                 "concepts map to", prog="enrichment")
+    parser.add_argument("infile", help="act2rdf or act_to_skos output (turtle, N-Triples or compact store)")
+    parser.add_argument("outfile", help="Enrichment output (.ttl or .nt)")
+    parser.add_argument("--cache", help="Response cache", default='enrichment-cache.db')
+    parser.add_argument("--ttl", help="Days a cached response stays valid", type=float, default=DEFAULT_TTL / 86400)
+    parser.add_argument("--concurrency", help="Concurrent requests per service host", type=int,
+                        default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--namespaces", help="Namespaces to enrich", nargs='+', default=list(services.keys()),
+                        choices=list(services.keys()))
+    parser.add_argument("--param", help="url template value, e.g. bioportalapikey=...", action='append', default=[])
+    parser.add_argument("--auth", help="Basic credentials for a namespace, e.g. LOINC=user:password",
+                        action='append', default=[])
+    parser.add_argument("--service", help="url template to use for a namespace, e.g. "
+                                          "RXNORM=http://localhost:8080/rxcui/{cid}/properties.json",
+                        action='append', default=[])
+    opts = parser.parse_args(argv)
+    overrides = parse_pairs(opts.service, '=')
+    unknown = overrides.keys() - services.keys()
+    if unknown:
+        parser.error(f"--service: unknown namespace(s): {', '.join(sorted(unknown))}")
+
+    auth = {ns: tuple(creds.split(':', 1)) for ns, creds in parse_pairs(opts.auth, '=').items()}
+    cache = ResponseCache(opts.cache, opts.ttl * 86400)
+    available = service_overrides(overrides)
+    enricher = Enricher({ns: available[ns] for ns in opts.namespaces}, cache, opts.concurrency,
+                        parse_pairs(opts.param, '='), auth)
+    for ns in opts.namespaces:
+        if ns not in enricher.access:
+            print(f"{ns}: no usable service (missing --param or --auth)")
+    targets = exact_match_targets(source_triples(opts.infile))
+    with open(opts.outfile, 'w', encoding='utf-8') as out:
+        with open_sink(out, 'nt' if opts.outfile.endswith('.nt') else 'ttl') as sink:
+            sink.bind('skos', SKOS)
+            sink.bind('owl', OWL)
+            for info in services.values():
+                sink.bind(info.namespace, info.officialuri)
+            outcomes = enrich(targets, enricher, sink)
+    cache.close()
+    print(f"{len(targets)} codes: {dict(outcomes)} ({dict(enricher.stats)})")
+    print(f"{len(sink)} triples written to {opts.outfile}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,5 +1,239 @@
-from rdflib import Graph
+import argparse
+import json
+import os
+import sys
+from itertools import groupby
+from typing import Dict, List, Iterator, Tuple, Iterable, Optional, TextIO, Any
 
-g = Graph()
-g.load('output.ttl', format="turtle")
-g.serialize('output.json', format="json-ld")
\ No newline at end of file
+from rdflib import Graph, Literal, BNode, RDF, RDFS, XSD
+from rdflib.namespace import DCTERMS
+from rdflib.term import Node
+from rdflib.plugins.parsers.ntriples import NTriplesParser, ParseError
+
+from compactstore import CompactGraph, COMPACT_EXT
+from termcache import LRUCache
+from namespaces_and_uris import namespaces
+
+Triple = Tuple[Node, Node, Node]
+
+CURIE_CACHE_SIZE = 100000       # IRIs whose compacted form is kept
+
+
+def build_context() -> Dict[str, str]:
+    """ Return the fixed JSON-LD @context: one prefix per entry in namespaces_and_uris.namespaces """
+    context = {name.lower(): str(ns) for name, ns in namespaces.items()}
+    for prefix, ns in (('rdf', RDF), ('rdfs', RDFS), ('xsd', XSD), ('dcterms', DCTERMS)):
+        context.setdefault(prefix, str(ns))
+    return context
+
+
+class NodeBuilder:
+    """ Build compacted JSON-LD node objects against the fixed context """
+    def __init__(self, context: Dict[str, str]) -> None:
+        # Longest namespace first so that nested namespaces pick the most specific prefix
+        self.prefixes = sorted(((ns, prefix) for prefix, ns in context.items()), key=lambda e: len(e[0]),
+                               reverse=True)
+        self.cache = LRUCache(self._compact, CURIE_CACHE_SIZE)
+
+    def _compact(self, iri: str) -> str:
+        for ns, prefix in self.prefixes:
+            if iri.startswith(ns) and len(iri) > len(ns):
+                return f"{prefix}:{iri[len(ns):]}"
+        return iri
+
+    def compact(self, iri: str) -> str:
+        return self.cache[iri]
+
+    def ref(self, node: Node) -> str:
+        return f"_:{node}" if isinstance(node, BNode) else self.compact(str(node))
+
+    def value(self, o: Node) -> Any:
+        if isinstance(o, Literal):
+            if o.language:
+                return {"@value": str(o), "@language": o.language}
+            if o.datatype:
+                return {"@value": str(o), "@type": self.compact(str(o.datatype))}
+            return str(o)
+        return {"@id": self.ref(o)}
+
+    def node(self, s: Node, pairs: Iterable[Tuple[Node, Node]]) -> Dict[str, Any]:
+        """
+        Return the node object for subject s
+        :param s: subject
+        :param pairs: (predicate, object) pairs of s
+        :return: JSON-LD node object
+        """
+        rslt: Dict[str, Any] = {"@id": self.ref(s)}
+        for p, o in pairs:
+            if p == RDF.type and not isinstance(o, Literal):
+                key, val = "@type", self.ref(o)
+            else:
+                key, val = self.compact(str(p)), self.value(o)
+            if key in rslt:
+                if not isinstance(rslt[key], list):
+                    rslt[key] = [rslt[key]]
+                rslt[key].append(val)
+            else:
+                rslt[key] = val
+        return rslt
+
+
+def subject_groups(triples: Iterable[Triple]) -> Iterator[Tuple[Node, List[Tuple[Node, Node]]]]:
+    """
+    Group consecutive triples by subject.  Input that is not ordered by subject is still exported correctly, but a
+    subject that recurs produces more than one node object.
+    """
+    for s, group in groupby(triples, key=lambda t: t[0]):
+        yield s, [(p, o) for _, p, o in group]
+
+
+class _TripleList(list):
+    """ NTriplesParser sink that collects the parsed triples """
+    def triple(self, s: Node, p: Node, o: Node) -> None:
+        self.append((s, p, o))
+
+
+def ntriples_triples(path: str) -> Iterator[Triple]:
+    """ Stream the triples of an N-Triples file, one line at a time, using rdflib's N-Triples line parser """
+    triples = _TripleList()
+    parser = NTriplesParser(triples)
+    with open(path, encoding='utf-8') as f:
+        for lineno, line in enumerate(f, start=1):
+            parser.line = line.rstrip('\r\n')
+            try:
+                parser.parseline()
+            except ParseError as e:
+                raise ParseError(f"{path}:{lineno}: invalid N-Triples line ({e}): {line!r}")
+            yield from triples
+            triples.clear()
+
+
+def compact_triples(path: str) -> Iterator[Triple]:
+    """ Stream the triples of a compact store in subject order """
+    with CompactGraph(path) as g:
+        yield from g.triples((None, None, None))
+
+
+def graph_triples(path: str, fmt: str) -> Iterator[Triple]:
+    """ Load an RDF file into a graph and return its triples grouped by subject """
+    g = Graph()
+    g.load(path, format=fmt)
+    for s in sorted(set(g.subjects())):
+        for p, o in g.predicate_objects(s):
+            yield s, p, o
+
+
+def source_triples(path: str) -> Iterator[Triple]:
+    """ Return the triples in path, streaming where the format allows it """
+    if path.endswith('.nt'):
+        return ntriples_triples(path)
+    if path.endswith(COMPACT_EXT):
+        return compact_triples(path)
+    return graph_triples(path, 'turtle' if path.endswith('.ttl') else 'xml')
+
+
+class JsonLdWriter:
+    """
+    Write node objects incrementally, either as JSON-LD documents ({"@context": ..., "@graph": [...]}) or as NDJSON
+    (one node object per line, with the context in a separate file).  If max_nodes is set, output is split across
+    numbered files of at most max_nodes nodes each.
+    """
+    def __init__(self, outfile: str, context: Dict[str, str], ndjson: bool = False, max_nodes: int = 0) -> None:
+        self.outfile = outfile
+        self.context = context
+        self.ndjson = ndjson
+        self.max_nodes = max_nodes
+        self.out: Optional[TextIO] = None
+        self.nfiles = 0
+        self.nnodes = 0
+        self.file_nodes = 0
+        self.files: List[str] = []
+        if ndjson:
+            base, _ = os.path.splitext(outfile)
+            self.context_file = base + '.context.jsonld'
+            with open(self.context_file, 'w', encoding='utf-8') as f:
+                json.dump({"@context": context}, f, indent=1)
+
+    def _file_name(self) -> str:
+        if not self.max_nodes:
+            return self.outfile
+        base, ext = os.path.splitext(self.outfile)
+        return f"{base}-{self.nfiles:04d}{ext}"
+
+    def _open(self) -> None:
+        self.nfiles += 1
+        name = self._file_name()
+        self.files.append(name)
+        self.out = open(name, 'w', encoding='utf-8')
+        self.file_nodes = 0
+        if not self.ndjson:
+            self.out.write('{"@context": ')
+            json.dump(self.context, self.out)
+            self.out.write(',\n "@graph": [\n')
+
+    def _close(self) -> None:
+        if self.out:
+            if not self.ndjson:
+                self.out.write('\n ]\n}\n')
+            self.out.close()
+            self.out = None
+
+    def write(self, node: Dict[str, Any]) -> None:
+        if self.out is None or (self.max_nodes and self.file_nodes >= self.max_nodes):
+            self._close()
+            self._open()
+        if self.ndjson:
+            node = dict([("@context", os.path.basename(self.context_file))] + list(node.items()))
+            self.out.write(json.dumps(node, ensure_ascii=False))
+            self.out.write('\n')
+        else:
+            if self.file_nodes:
+                self.out.write(',\n')
+            self.out.write('  ')
+            self.out.write(json.dumps(node, ensure_ascii=False))
+        self.file_nodes += 1
+        self.nnodes += 1
+
+    def close(self) -> None:
+        if self.out is None and not self.ndjson and not self.files:
+            self._open()
+        self._close()
+
+    def __enter__(self) -> "JsonLdWriter":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+def export(triples: Iterable[Triple], outfile: str, ndjson: bool = False, max_nodes: int = 0) -> int:
+    """
+    Export triples as JSON-LD, one node object per subject
+    :param triples: triples, ideally ordered (or at least grouped) by subject
+    :param outfile: output file (name template if max_nodes is set)
+    :param ndjson: write one node object per line
+    :param max_nodes: maximum number of node objects per file.  0 means no limit
+    :return: number of node objects written
+    """
+    context = build_context()
+    builder = NodeBuilder(context)
+    with JsonLdWriter(outfile, context, ndjson, max_nodes) as writer:
+        for s, pairs in subject_groups(triples):
+            writer.write(builder.node(s, pairs))
+    return writer.nnodes
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description="Convert act2rdf output to JSON-LD", prog="to_jsonld")
+    parser.add_argument("infile", help="Input file: N-Triples (sorted by subject), compact store or turtle",
+                        nargs='?', default='output.ttl')
+    parser.add_argument("outfile", help="Output file", nargs='?', default='output.json')
+    parser.add_argument("--ndjson", help="Write one node object per line", action="store_true")
+    parser.add_argument("--split", help="Maximum number of node objects per output file", type=int, default=0)
+    opts = parser.parse_args(argv)
+    nnodes = export(source_triples(opts.infile), opts.outfile, opts.ndjson, opts.split)
+    print(f"{nnodes} nodes written")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
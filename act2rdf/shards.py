@@ -0,0 +1,160 @@
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import re
+from typing import Dict, List, TextIO, Any
+
+from rdflib import URIRef
+from rdflib.namespace import SKOS
+from rdflib.term import Node
+
+from hierarchy import PathIndex
+from triplesink import TripleSink, Triple, open_sink
+
+MANIFEST_SUFFIX = '-manifest.json'
+SCHEME_KEY = 'scheme'           # Shard for triples whose subject isn't under any top concept (schemes, codes).
+                                # Reserved -- a top concept named 'scheme' gets a suffixed key
+
+UNSAFE_CHARS_RE = re.compile(r'[^A-Za-z0-9_.\-]+')
+
+
+def shard_key(node: Node) -> str:
+    """ Return a file name safe shard key for top concept node: its local name.  This need not be unique """
+    name = re.split(r'[/#]', str(node).rstrip('/#'))[-1] if isinstance(node, URIRef) else str(node)
+    return UNSAFE_CHARS_RE.sub('_', name) or SCHEME_KEY
+
+
+def manifest_file(base: str) -> str:
+    return base + MANIFEST_SUFFIX
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ShardedSink(TripleSink):
+    """
+    Split the output by top concept and size.  Each triple goes to the shard of its subject's top concept -- the
+    object of skos:hasTopConcept, or the highest skos:broader ancestor -- and each shard is split into numbered parts
+    of at most max_triples triples.  When closed, a manifest listing every part with its top concepts, triple count,
+    size and sha256 is written to <base>-manifest.json, so loaders can ingest parts in parallel or select by top
+    concept.  Each top concept has a shard of its own: when two local names sanitize to the same key, the later one
+    gets a numeric suffix (A_B, A_B_2).
+
+    Shard membership is assigned as the hierarchy streams past, which needs parents to be seen before their
+    children (as act2rdf emits them).  Otherwise call assign_hierarchy with the complete graph first.
+    :param base: output path prefix.  Parts are named <base>.<key>.<part>.<ext>[.gz]
+    :param fmt: 'nt' or 'ttl'
+    :param max_triples: maximum triples per part.  0 means one part per shard
+    :param compress: gzip the parts
+    """
+    def __init__(self, base: str, fmt: str = 'ttl', max_triples: int = 0, compress: bool = False,
+                 dedup: bool = True) -> None:
+        super().__init__(dedup)
+        self.base = base
+        self.fmt = fmt
+        self.max_triples = max_triples
+        self.compress = compress
+        self.keys: Dict[Node, str] = dict()
+        self.top_concepts: Dict[str, List[str]] = dict()
+        self.sinks: Dict[str, TripleSink] = dict()
+        self.streams: Dict[str, TextIO] = dict()
+        self.parts: Dict[str, int] = dict()
+        self.shards: List[Dict[str, Any]] = []
+
+    def _assign_top(self, node: Node) -> str:
+        key = self.keys.get(node)
+        if key is None:
+            key = base = shard_key(node)
+            n = 1
+            while key == SCHEME_KEY or key in self.top_concepts:
+                n += 1
+                key = f"{base}_{n}"
+            self.keys[node] = key
+            self.top_concepts[key] = [str(node)]
+        return key
+
+    def assign_hierarchy(self, g) -> None:
+        """ Assign every concept in g to the shard of its top concept up front """
+        index = PathIndex()
+        for child, parent in g.subject_objects(SKOS.broader):
+            index.add_edge(child, parent)
+        # Concepts not under a declared top concept are rooted at their highest ancestors.  Nodes that are only reached
+        # through a cycle are taken as tops last.
+        tops = [tc for _, tc in g.subject_objects(SKOS.hasTopConcept)]
+        for top in itertools.chain(tops, index.roots(), list(index.parents)):
+            if top in self.keys:
+                continue
+            key = self._assign_top(top)
+            for node in index.descendants(top):
+                self.keys.setdefault(node, key)
+
+    def _key(self, triple: Triple) -> str:
+        s, p, o = triple
+        if p == SKOS.hasTopConcept:
+            self._assign_top(o)
+        elif p == SKOS.broader and s not in self.keys:
+            parent_key = self.keys.get(o)
+            if parent_key is not None:
+                self.keys[s] = parent_key
+            else:
+                # o is the scheme root (or hasn't been seen yet) -- s starts a shard of its own
+                self._assign_top(s)
+        return self.keys.get(s, SCHEME_KEY)
+
+    def _part_name(self, key: str, part: int) -> str:
+        return f"{self.base}.{key}.{part:04d}.{self.fmt}" + ('.gz' if self.compress else '')
+
+    def _open(self, key: str) -> TripleSink:
+        part = self.parts[key] = self.parts.get(key, 0) + 1
+        path = self._part_name(key, part)
+        stream = gzip.open(path, 'wt', encoding='utf-8') if self.compress else open(path, 'w', encoding='utf-8')
+        sink = open_sink(stream, self.fmt, dedup=False)
+        sink.n3 = self.n3
+        for prefix, ns in self.namespaces.items():
+            sink.bind(prefix, ns)
+        self.sinks[key] = sink
+        self.streams[key] = stream
+        return sink
+
+    def _close_shard(self, key: str) -> None:
+        sink = self.sinks.pop(key)
+        stream = self.streams.pop(key)
+        sink.close()
+        stream.close()
+        path = self._part_name(key, self.parts[key])
+        self.shards.append(dict(file=os.path.basename(path), key=key, top_concepts=self.top_concepts.get(key, []),
+                                part=self.parts[key], triples=len(sink), bytes=os.path.getsize(path),
+                                sha256=file_sha256(path)))
+
+    def _write(self, triple: Triple) -> None:
+        key = self._key(triple)
+        sink = self.sinks.get(key)
+        if sink is None:
+            sink = self._open(key)
+        elif self.max_triples and len(sink) >= self.max_triples:
+            self._close_shard(key)
+            sink = self._open(key)
+        sink.add(triple)
+
+    def close(self) -> None:
+        for key in list(self.sinks):
+            self._close_shard(key)
+        self.shards.sort(key=lambda e: e['file'])
+        manifest = dict(format=self.fmt, compression='gzip' if self.compress else None,
+                        triples=sum(e['triples'] for e in self.shards),
+                        prefixes={prefix: str(ns) for prefix, ns in self.namespaces.items()},
+                        shards=self.shards)
+        with open(manifest_file(self.base), 'w') as f:
+            json.dump(manifest, f, indent=1)
+
+
+def shard_base(output: str) -> str:
+    """ Return the shard path prefix for output file name output ('act-ontology.ttl' -> 'act-ontology') """
+    return os.path.splitext(output)[0]
@@ -0,0 +1,59 @@
+from collections import OrderedDict
+from typing import Callable, Optional, Dict, Hashable
+
+from rdflib import Namespace, URIRef
+
+DEFAULT_CACHE_SIZE = 500000         # Maximum number of terms to hold
+
+
+class LRUCache:
+    """
+    Bounded mapping from key to term with least recently used eviction and hit/miss counters
+    """
+    def __init__(self, factory: Callable[[Hashable], object], maxsize: int = DEFAULT_CACHE_SIZE) -> None:
+        self.factory = factory
+        self.maxsize = maxsize
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __getitem__(self, key: Hashable):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            value = self.entries[key] = self.factory(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def stats(self) -> Dict[str, int]:
+        return dict(hits=self.hits, misses=self.misses, size=len(self.entries), maxsize=self.maxsize)
+
+
+class TermCache:
+    """
+    Interned URIs for ACT node construction.  URIs are keyed by the raw path segment (e.g. 'A18090800'), so the
+    normalization and namespace concatenation are done once per distinct concept rather than once per row.  Labels
+    are not interned: each occurs in a single row, so a cache of them would only hold memory.
+    """
+    def __init__(self, namespace: Namespace, normalize: Optional[Callable[[str], str]] = None,
+                 maxsize: int = DEFAULT_CACHE_SIZE) -> None:
+        self.namespace = namespace
+        self.normalize = normalize
+        self.uris = LRUCache(self._mk_uri, maxsize)
+
+    def _mk_uri(self, segment: str) -> URIRef:
+        return self.namespace[self.normalize(segment) if self.normalize else segment]
+
+    def uri(self, segment: str) -> URIRef:
+        return self.uris[segment]
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return dict(uris=self.uris.stats())
@@ -0,0 +1,162 @@
+import hashlib
+import re
+from typing import Callable, Dict, Optional, Set, TextIO, Tuple
+
+from rdflib import Namespace, URIRef, Literal, RDF
+from rdflib.plugins.serializers.nt import _quoteLiteral
+from rdflib.term import Node
+
+from termcache import LRUCache
+
+Triple = Tuple[Node, Node, Node]
+
+# Local names that can be written as a Turtle prefixed name without escaping
+PNAME_LOCAL_RE = re.compile(r'[A-Za-z0-9_][A-Za-z0-9_\-.]*$')
+
+# The characters URIRef.n3() rejects
+INVALID_IRI_RE = re.compile(r'[<>" {}|\\^`]')
+
+N3_CACHE_SIZE = 200000      # Terms whose N-Triples form is kept.  URIRef.n3() re-validates the IRI on every call
+
+
+class TripleSink:
+    """
+    Write-once destination for triples.  Duplicates are dropped using a set of 8 byte triple digests rather than
+    the full term indexes of an rdflib Graph, so memory is bounded by the number of distinct triples, not their size.
+
+    A sink exposes the subset of the rdflib Graph api used by the converters (``add``, ``bind`` and ``len``) so it
+    can be passed wherever a Graph is expected.
+    """
+    def __init__(self, dedup: bool = True) -> None:
+        self.dedup = dedup
+        self.seen: Set[int] = set()
+        self.namespaces: Dict[str, Namespace] = dict()
+        self.ntriples = 0
+        self.n3 = LRUCache(node_n3, N3_CACHE_SIZE)
+
+    def bind(self, prefix: str, namespace: Namespace) -> None:
+        if str(namespace) not in self.namespaces.values():
+            self.namespaces[prefix] = Namespace(str(namespace))
+
+    def add(self, triple: Triple) -> None:
+        if self.dedup:
+            key = triple_digest(triple, self.n3.__getitem__)
+            if key in self.seen:
+                return
+            self.seen.add(key)
+        self.ntriples += 1
+        self._write(triple)
+
+    def _write(self, triple: Triple) -> None:
+        raise NotImplementedError()
+
+    def close(self) -> None:
+        pass
+
+    def __len__(self) -> int:
+        return self.ntriples
+
+    def __enter__(self) -> "TripleSink":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+def node_n3(t: Node) -> str:
+    """ Return the N-Triples form of t.  IRIs are checked with a single regex search rather than rdflib's per
+    character test, which is most of the cost of URIRef.n3().  Literals are escaped as rdflib's N-Triples serializer
+    does -- Literal.n3() writes values with line breaks as Turtle long strings, which N-Triples doesn't allow """
+    if type(t) is URIRef and not INVALID_IRI_RE.search(t):
+        return f"<{t}>"
+    if isinstance(t, Literal):
+        return _quoteLiteral(t)
+    return t.n3()
+
+
+def triple_digest(triple: Triple, n3: Callable[[Node], str] = node_n3) -> int:
+    """
+    Return a compact (64 bit) digest of a triple for duplicate detection
+    :param triple: triple to digest
+    :param n3: function returning the N-Triples form of a term
+    :return: integer digest
+    """
+    h = hashlib.blake2b(digest_size=8)
+    for t in triple:
+        h.update(n3(t).encode('utf-8'))
+        h.update(b'\x00')
+    return int.from_bytes(h.digest(), 'little')
+
+
+class NTriplesSink(TripleSink):
+    """ Write triples as N-Triples, one line per triple, as they arrive """
+    def __init__(self, out: TextIO, dedup: bool = True) -> None:
+        super().__init__(dedup)
+        self.out = out
+
+    def _write(self, triple: Triple) -> None:
+        n3 = self.n3
+        self.out.write(f"{n3[triple[0]]} {n3[triple[1]]} {n3[triple[2]]} .\n")
+
+    def close(self) -> None:
+        self.out.flush()
+
+
+class TurtleSink(TripleSink):
+    """
+    Write triples as Turtle, grouping consecutive triples that share a subject into a single statement.  Input
+    produced row by row (as the converters do) therefore comes out grouped by concept without having to hold the
+    graph.  Prefixes must be bound before the first triple is added.
+    """
+    def __init__(self, out: TextIO, dedup: bool = True) -> None:
+        super().__init__(dedup)
+        self.out = out
+        self.subject: Optional[Node] = None
+        self.header_written = False
+
+    def _qname(self, t: Node) -> str:
+        if isinstance(t, URIRef):
+            if t == RDF.type:
+                return 'a'
+            for prefix, ns in self.namespaces.items():
+                if t.startswith(ns):
+                    local = t[len(ns):]
+                    if PNAME_LOCAL_RE.match(local) and not local.endswith('.'):
+                        return f"{prefix}:{local}"
+        return self.n3[t]
+
+    def _write(self, triple: Triple) -> None:
+        s, p, o = triple
+        if not self.header_written:
+            for prefix, ns in self.namespaces.items():
+                self.out.write(f"@prefix {prefix}: <{ns}> .\n")
+            self.out.write('\n')
+            self.header_written = True
+        if s == self.subject:
+            self.out.write(f" ;\n    {self._qname(p)} {self._qname(o)}")
+        else:
+            if self.subject is not None:
+                self.out.write(' .\n\n')
+            self.subject = s
+            self.out.write(f"{self._qname(s)} {self._qname(p)} {self._qname(o)}")
+
+    def close(self) -> None:
+        if self.subject is not None:
+            self.out.write(' .\n')
+            self.subject = None
+        self.out.flush()
+
+
+def open_sink(out: TextIO, fmt: str, dedup: bool = True) -> TripleSink:
+    """
+    Return a streaming sink for format fmt
+    :param out: output stream
+    :param fmt: 'nt' or 'ttl'
+    :param dedup: drop duplicate triples
+    :return: sink
+    """
+    if fmt == 'nt':
+        return NTriplesSink(out, dedup)
+    elif fmt == 'ttl':
+        return TurtleSink(out, dedup)
+    raise ValueError(f"Unrecognized streaming format: {fmt}")
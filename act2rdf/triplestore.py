@@ -0,0 +1,132 @@
+from array import array
+from typing import Dict, Iterator, List, Optional, Set, TextIO, Tuple, Union
+
+from rdflib import Namespace, URIRef, RDF, RDFS, XSD
+from rdflib.namespace import SKOS, XMLNS
+from rdflib.term import Node
+
+from compactstore import ID_BITS, ID_MASK
+from triplesink import Triple, open_sink
+
+# Predicates with their own (subject, object) adjacency lists -- the ones the converters query
+INDEXED_PREDICATES = (SKOS.broader, SKOS.exactMatch, SKOS.hasTopConcept)
+
+Pattern = Tuple[Optional[Node], Optional[Node], Optional[Node]]
+
+
+class TripleStore:
+    """
+    Add-only, in-process triple set for conversion runs.  Terms are interned to integer ids and each triple is held
+    as a single packed int in a set, which costs a small fraction of the per triple memory of an rdflib Dataset and
+    its quad indexes.  Predicates in ``indexed`` additionally keep (subject, object) id columns so that
+    ``subject_objects`` on them doesn't scan the store.
+
+    The store implements the part of the rdflib Graph api that the converters use: ``add``, ``len``, iteration,
+    ``triples``, ``subject_objects``, ``objects``, ``bind``, ``namespaces`` and ``serialize``.
+    """
+    def __init__(self, indexed: Tuple[URIRef, ...] = INDEXED_PREDICATES) -> None:
+        self.term_ids: Dict[Node, int] = dict()
+        self.terms: List[Node] = []
+        self.keys: Set[int] = set()
+        self.adjacency: Dict[int, Tuple[array, array]] = {self._id(p): (array('I'), array('I')) for p in indexed}
+        self._namespaces: Dict[str, URIRef] = dict()
+        for prefix, ns in (('xml', XMLNS), ('rdf', RDF), ('rdfs', RDFS), ('xsd', XSD)):
+            self.bind(prefix, ns)
+
+    def _id(self, t: Node) -> int:
+        tid = self.term_ids.get(t)
+        if tid is None:
+            tid = self.term_ids[t] = len(self.terms)
+            self.terms.append(t)
+        return tid
+
+    def _unpack(self, key: int) -> Triple:
+        terms = self.terms
+        return terms[key >> ID_BITS * 2], terms[(key >> ID_BITS) & ID_MASK], terms[key & ID_MASK]
+
+    def add(self, triple: Triple) -> None:
+        s, p, o = (self._id(t) for t in triple)
+        key = (s << ID_BITS * 2) | (p << ID_BITS) | o
+        if key not in self.keys:
+            self.keys.add(key)
+            columns = self.adjacency.get(p)
+            if columns is not None:
+                columns[0].append(s)
+                columns[1].append(o)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __iter__(self) -> Iterator[Triple]:
+        for key in self.keys:
+            yield self._unpack(key)
+
+    def __contains__(self, triple: Triple) -> bool:
+        ids = [self.term_ids.get(t) for t in triple]
+        return None not in ids and ((ids[0] << ID_BITS * 2) | (ids[1] << ID_BITS) | ids[2]) in self.keys
+
+    def triples(self, pattern: Pattern) -> Iterator[Triple]:
+        """ Return the triples matching pattern.  None matches anything """
+        ids = []
+        for t in pattern:
+            tid = self.term_ids.get(t) if t is not None else None
+            if t is not None and tid is None:
+                return
+            ids.append(tid)
+        s, p, o = ids
+        if None not in ids:
+            if ((s << ID_BITS * 2) | (p << ID_BITS) | o) in self.keys:
+                yield tuple(pattern)
+        elif p in self.adjacency:
+            terms = self.terms
+            for si, oi in zip(*self.adjacency[p]):
+                if (s is None or si == s) and (o is None or oi == o):
+                    yield terms[si], terms[p], terms[oi]
+        else:
+            for key in self.keys:
+                if (s is None or key >> ID_BITS * 2 == s) and (p is None or (key >> ID_BITS) & ID_MASK == p) and \
+                        (o is None or key & ID_MASK == o):
+                    yield self._unpack(key)
+
+    def ordered(self) -> Iterator[Triple]:
+        """ Return the triples grouped by subject -- sorting the packed keys orders them by subject id """
+        for key in sorted(self.keys):
+            yield self._unpack(key)
+
+    def subject_objects(self, predicate: URIRef) -> Iterator[Tuple[Node, Node]]:
+        for s, _, o in self.triples((None, predicate, None)):
+            yield s, o
+
+    def objects(self, subject: Node, predicate: URIRef) -> Iterator[Node]:
+        for _, _, o in self.triples((subject, predicate, None)):
+            yield o
+
+    def bind(self, prefix: str, namespace: Union[Namespace, URIRef, str], override: bool = True) -> None:
+        if override or prefix not in self._namespaces:
+            self._namespaces[prefix] = URIRef(str(namespace))
+
+    def namespaces(self) -> Iterator[Tuple[str, URIRef]]:
+        return iter(self._namespaces.items())
+
+    def serialize(self, destination: Union[str, TextIO], format: str = 'turtle') -> None:
+        """
+        Write the store as Turtle or N-Triples, grouped by subject
+        :param destination: file name or text stream
+        :param format: 'turtle' ('ttl') or 'nt' ('ntriples')
+        """
+        fmt = dict(turtle='ttl', ttl='ttl', nt='nt', ntriples='nt').get(format)
+        if fmt is None:
+            raise ValueError(f"Unrecognized format: {format}")
+        if isinstance(destination, str):
+            with open(destination, 'w', encoding='utf-8') as out:
+                self._write(out, fmt)
+        else:
+            self._write(destination, fmt)
+
+    def _write(self, out: TextIO, fmt: str) -> None:
+        # The keys are unique, so the sink has no duplicates to remove
+        with open_sink(out, fmt, dedup=False) as sink:
+            for prefix, ns in self._namespaces.items():
+                sink.bind(prefix, ns)
+            for t in self.ordered():
+                sink.add(t)
@@ -0,0 +1,109 @@
+import json
+import os
+import sys
+import threading
+import unittest
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import TemporaryDirectory
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'act2rdf')]
+
+from ontology import enrichment
+from ontology.enrichment import Enricher, ResponseCache, service_overrides, ACTIVE, ERROR, NOT_FOUND
+
+
+class StubRxNav(BaseHTTPRequestHandler):
+    """
+    RxNav properties stub.  Code 404 is not found, 500 fails, 429 is rate limited on every request and r429 on its
+    first two requests.  Anything else is found.
+    """
+    protocol_version = 'HTTP/1.1'
+    hits: Counter = Counter()
+
+    def do_GET(self) -> None:
+        code = self.path.split('/')[-2]
+        self.hits[code] += 1
+        headers = {}
+        if code == '429' or (code == 'r429' and self.hits[code] <= 2):
+            status, body = 429, b'slow down'
+            headers['Retry-After'] = '0'
+        elif code in ('404', '500'):
+            status, body = int(code), b'error'
+        else:
+            status, body = 200, json.dumps({'properties': {'name': 'Drug ' + code}}).encode()
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class EnrichmentTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        StubRxNav.hits.clear()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubRxNav)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.template = f'http://127.0.0.1:{self.server.server_port}/rxcui/{{cid}}/properties.json'
+        self.dir = TemporaryDirectory()
+        self.cache_file = os.path.join(self.dir.name, 'cache.db')
+        self.save_backoff = enrichment.BACKOFF
+        enrichment.BACKOFF = 0.01
+
+    def tearDown(self) -> None:
+        enrichment.BACKOFF = self.save_backoff
+        self.server.shutdown()
+        self.server.server_close()
+        self.dir.cleanup()
+
+    def resolve(self, codes):
+        cache = ResponseCache(self.cache_file)
+        enricher = Enricher(service_overrides({'RXNORM': self.template}), cache, 4)
+        rslt = enricher.resolve([('RXNORM', code) for code in codes])
+        cache.close()
+        return rslt, enricher.stats
+
+    def test_lookups(self) -> None:
+        rslt, stats = self.resolve(['1', '1', '2', '404', '500', '429', 'r429'])
+        self.assertEqual((ACTIVE, 'Drug 1'), (rslt[('RXNORM', '1')].status, rslt[('RXNORM', '1')].label))
+        self.assertEqual(NOT_FOUND, rslt[('RXNORM', '404')].status)
+        self.assertEqual(ERROR, rslt[('RXNORM', '500')].status)
+        self.assertEqual(ERROR, rslt[('RXNORM', '429')].status)
+        self.assertEqual('Drug r429', rslt[('RXNORM', 'r429')].label)
+        # Duplicate codes are requested once, rate limited codes are retried and server errors are not
+        self.assertEqual(1, StubRxNav.hits['1'])
+        self.assertEqual(1, StubRxNav.hits['500'])
+        self.assertEqual(3, StubRxNav.hits['r429'])
+        self.assertEqual(enrichment.MAX_RETRIES + 1, StubRxNav.hits['429'])
+        self.assertEqual(enrichment.MAX_RETRIES + 2, stats['retried'])
+
+        # Found and not found responses come from the cache, errors are asked for again
+        StubRxNav.hits.clear()
+        rslt, stats = self.resolve(['1', '2', '404', '500', 'r429'])
+        self.assertEqual(4, stats['cached'])
+        self.assertEqual({'500': 1}, dict(StubRxNav.hits))
+        self.assertEqual('Drug 1', rslt[('RXNORM', '1')].label)
+
+    def test_main(self) -> None:
+        infile = os.path.join(self.dir.name, 'in.nt')
+        outfile = os.path.join(self.dir.name, 'out.nt')
+        rxnorm = 'http://www.nlm.nih.gov/research/umls/rxnorm/'
+        with open(infile, 'w') as f:
+            for concept, code in (('A', '1'), ('B', '1'), ('C', '404')):
+                f.write(f'<http://example.org/{concept}> <http://www.w3.org/2004/02/skos/core#exactMatch> '
+                        f'<{rxnorm}{code}> .\n')
+        enrichment.main([infile, outfile, '--cache', self.cache_file, '--namespaces', 'RXNORM',
+                         '--service', f'RXNORM={self.template}'])
+        with open(outfile) as f:
+            self.assertEqual([f'<{rxnorm}1> <http://www.w3.org/2004/02/skos/core#prefLabel> "Drug 1" .'],
+                             [line.strip() for line in f if line.strip()])
+        self.assertEqual({'1': 1, '404': 1}, dict(StubRxNav.hits))
+
+
+if __name__ == '__main__':
+    unittest.main()